@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Usage Report Benchmark
+generate_report süresini satır ve kullanıcı sayısına göre ölçer:
+eski N+1 yaklaşımı (kullanıcı başına ayrı sorgular) ile gruplanmış SQL karşılaştırması
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+# monitoring-dashboard.py'yi dosyadan yükle (dosya adında tire var)
+_spec = importlib.util.spec_from_file_location(
+    "monitoring_dashboard",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitoring-dashboard.py")
+)
+monitoring_dashboard = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(monitoring_dashboard)
+UsageMonitor = monitoring_dashboard.UsageMonitor
+
+MODELS = ["autox", "sonnet-4-x", "sonnet-4-5-x"]
+
+INSERT_SQL = '''
+    INSERT INTO usage_logs
+    (user_id, ts, model_id, tokens_used, request_count,
+     response_time, success, cost_usd)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def populate(db_path: str, rows: int, users: int, days: int = 30):
+    """Sentetik kullanım verisi (tek transaction, executemany)"""
+    monitor = UsageMonitor(db_path)
+    rng = random.Random(42)
+    now = datetime.now()
+    window = days * 86400
+    
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO models (name) VALUES (?)", [(model,) for model in MODELS])
+    model_ids = dict(conn.execute("SELECT name, id FROM models"))
+    batch: List[tuple] = []
+    with conn:
+        for _ in range(rows):
+            model = rng.choice(MODELS)
+            tokens = rng.randint(100, 2000)
+            timestamp = now - timedelta(seconds=rng.uniform(0, window))
+            batch.append((
+                f"user_{rng.randrange(users):05d}",
+                int(timestamp.timestamp()),
+                model_ids[model],
+                tokens,
+                1,
+                rng.uniform(0.5, 5.0),
+                1 if rng.random() > 0.05 else 0,
+                monitor.estimate_cost(model, tokens)
+            ))
+            if len(batch) >= 50000:
+                conn.executemany(INSERT_SQL, batch)
+                batch = []
+        if batch:
+            conn.executemany(INSERT_SQL, batch)
+    conn.close()
+    
+    # Ham satırlar doğrudan yazıldı: rollup'ları bir kez hesapla
+    monitor.rebuild_rollups()
+    return monitor
+
+def legacy_report(db_path: str, days: int = 30) -> Dict[str, Any]:
+    """Eski yaklaşım: DISTINCT user_id + kullanıcı başına 3 sorgu (her biri ayrı bağlantı), Python'da sıralama.
+    Sorgular v2 şemasına göre (parent_request_id IS NULL: partial covering index kullanılsın)"""
+    now = datetime.now()
+    month_ago = now - timedelta(days=days)
+    day_ago = now - timedelta(days=1)
+    
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute(
+        "SELECT DISTINCT user_id FROM usage_logs WHERE ts >= ? AND parent_request_id IS NULL", (int(month_ago.timestamp()),)
+    )]
+    conn.close()
+    
+    stats = []
+    for user_id in user_ids:
+        conn = sqlite3.connect(db_path)
+        total = conn.execute('''
+            SELECT COUNT(*), SUM(tokens_used), SUM(cost_usd), AVG(response_time),
+                   AVG(CASE WHEN success THEN 1.0 ELSE 0.0 END), MAX(ts)
+            FROM usage_logs WHERE user_id = ? AND ts >= ? AND parent_request_id IS NULL
+        ''', (user_id, int(month_ago.timestamp()))).fetchone()
+        conn.execute('''
+            SELECT COUNT(*), SUM(tokens_used) FROM usage_logs WHERE user_id = ? AND ts >= ? AND parent_request_id IS NULL
+        ''', (user_id, int(day_ago.timestamp()))).fetchone()
+        conn.execute('''
+            SELECT COUNT(*), SUM(tokens_used) FROM usage_logs WHERE user_id = ? AND ts >= ? AND parent_request_id IS NULL
+        ''', (user_id, int(month_ago.timestamp()))).fetchone()
+        conn.close()
+        stats.append((user_id, total[0], total[1], total[2]))
+    
+    by_cost = sorted(stats, key=lambda x: x[3], reverse=True)
+    by_requests = sorted(by_cost, key=lambda x: x[1], reverse=True)[:10]
+    return {
+        "total_users": len(stats),
+        "total_requests": sum(s[1] for s in stats),
+        "top_users_by_requests": by_requests,
+        "top_users_by_cost": by_cost[:10]
+    }
+
+def timed(fn, *args) -> tuple:
+    """(saniye, sonuç)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description="generate_report benchmark (N+1 vs gruplanmış SQL)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--skip-legacy-above", type=int, default=10_000,
+                        help="bu kullanıcı sayısının üstünde eski yaklaşımı ölçme")
+    args = parser.parse_args()
+    
+    print("=" * 80)
+    print("📊 USAGE REPORT BENCHMARK")
+    print("=" * 80)
+    print(f"{'Satır':>12} {'Kullanıcı':>10} {'N+1 (s)':>10} {'Gruplanmış (s)':>15} {'Hızlanma':>10} {'Limit (ms)':>11}")
+    print("-" * 80)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            for users in args.users:
+                db_path = os.path.join(tmp, f"usage_{rows}_{users}.db")
+                monitor = populate(db_path, rows, users)
+                
+                new_time, report = timed(monitor.generate_report, 30)
+                
+                # Tek kullanıcı limit kontrolü (admission control yolu), 100 çağrı ortalaması
+                limit_time, _ = timed(lambda: [
+                    monitor.check_user_limits("user_00000", {"daily_requests": 100}) for _ in range(100)
+                ])
+                
+                if users <= args.skip_legacy_above:
+                    legacy_time, legacy = timed(legacy_report, db_path, 30)
+                    # Aynı toplamları üretmeli
+                    assert legacy["total_users"] == report["summary"]["total_users"]
+                    assert legacy["total_requests"] == report["summary"]["total_requests"]
+                    legacy_text = f"{legacy_time:10.3f}"
+                    speedup = f"{legacy_time / new_time:9.1f}x"
+                else:
+                    legacy_text = f"{'-':>10}"
+                    speedup = f"{'-':>10}"
+                
+                print(f"{rows:>12,} {users:>10,} {legacy_text} {new_time:15.3f} {speedup} {limit_time * 10:11.3f}")
+                os.remove(db_path)
+    
+    print("-" * 80)
+    print("✅ Benchmark tamamlandı")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Usage Schema Benchmark
+usage_logs şema v1 (metin timestamp, satırda model adı) ile v2 (epoch INTEGER, models lookup tablosu,
+covering index'ler) karşılaştırması: disk boyutu, migration/backfill süresi ve ham satır sorguları
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+# monitoring-dashboard.py'yi dosyadan yükle (dosya adında tire var)
+_spec = importlib.util.spec_from_file_location(
+    "monitoring_dashboard",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitoring-dashboard.py")
+)
+monitoring_dashboard = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(monitoring_dashboard)
+UsageMonitor = monitoring_dashboard.UsageMonitor
+
+MODELS = ["autox", "sonnet-4-x", "sonnet-4-5-x"]
+
+# Şema v1'deki usage_logs (user_version'dan önceki veritabanları)
+V1_SCHEMA = [
+    '''
+    CREATE TABLE usage_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        timestamp DATETIME NOT NULL,
+        model TEXT NOT NULL,
+        tokens_used INTEGER NOT NULL,
+        request_count INTEGER DEFAULT 1,
+        response_time REAL NOT NULL,
+        success BOOLEAN NOT NULL,
+        cost_usd REAL NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        request_id TEXT,
+        parent_request_id TEXT
+    )
+    ''',
+    "CREATE INDEX idx_user_timestamp ON usage_logs(user_id, timestamp)",
+    "CREATE INDEX idx_timestamp ON usage_logs(timestamp)",
+    "CREATE INDEX idx_request ON usage_logs(request_id)",
+    "CREATE INDEX idx_parent_request ON usage_logs(parent_request_id)"
+]
+
+V1_INSERT_SQL = '''
+    INSERT INTO usage_logs
+    (user_id, timestamp, model, tokens_used, request_count,
+     response_time, success, cost_usd, request_id, parent_request_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Aynı sorgular iki şemada: ham satırlardan (user_id, model) pencere toplamları
+V1_WINDOW_SQL = '''
+    SELECT user_id, model, COUNT(*), SUM(tokens_used), SUM(cost_usd), SUM(response_time),
+           SUM(CASE WHEN success THEN 1 ELSE 0 END), MAX(timestamp)
+    FROM usage_logs
+    WHERE timestamp >= ? AND timestamp < ? AND parent_request_id IS NULL {user_filter}
+    GROUP BY user_id, model
+'''
+
+V2_WINDOW_SQL = '''
+    SELECT raw.user_id, models.name, raw.requests, raw.tokens, raw.cost_usd, raw.response_time_sum,
+           raw.successes, raw.last_ts
+    FROM (
+        SELECT user_id, model_id, COUNT(*) AS requests, SUM(tokens_used) AS tokens, SUM(cost_usd) AS cost_usd,
+               SUM(response_time) AS response_time_sum, SUM(success) AS successes, MAX(ts) AS last_ts
+        FROM usage_logs
+        WHERE ts >= ? AND ts < ? AND parent_request_id IS NULL {user_filter}
+        GROUP BY user_id, model_id
+    ) AS raw
+    JOIN models ON models.id = raw.model_id
+'''
+
+def build_v1(db_path: str, rows: int, users: int, days: int = 30, chunk_ratio: float = 0.1):
+    """Sentetik v1 veritabanı: üst seviye istekler + chunk_ratio oranında decomposition chunk kayıtları"""
+    rng = random.Random(42)
+    now = datetime.now()
+    window = days * 86400
+    
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")  # Sadece veri üretimi için
+    for statement in V1_SCHEMA:
+        conn.execute(statement)
+    
+    batch: List[tuple] = []
+    with conn:
+        for i in range(rows):
+            model = rng.choice(MODELS)
+            tokens = rng.randint(100, 2000)
+            timestamp = now - timedelta(seconds=rng.uniform(0, window))
+            is_chunk = i > 0 and rng.random() < chunk_ratio
+            batch.append((
+                f"user_{rng.randrange(users):05d}",
+                timestamp.isoformat(" "),
+                model,
+                tokens,
+                1,
+                rng.uniform(0.5, 5.0),
+                rng.random() > 0.05,
+                (tokens / 1_000_000) * 3.0,
+                None if is_chunk else f"{i:032x}",
+                f"{rng.randrange(i):032x}" if is_chunk else None
+            ))
+            if len(batch) >= 100_000:
+                conn.executemany(V1_INSERT_SQL, batch)
+                batch = []
+        if batch:
+            conn.executemany(V1_INSERT_SQL, batch)
+    conn.close()
+
+def usage_logs_size(db_path: str) -> int:
+    """usage_logs (+ models) tablo ve index sayfalarının toplam boyutu (dbstat yoksa dosya boyutu)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        size = conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN ('usage_logs', 'models'))
+        ''').fetchone()[0]
+    except sqlite3.OperationalError:
+        size = os.path.getsize(db_path)
+    conn.close()
+    return size or 0
+
+def timed(fn: Callable, *args) -> tuple:
+    """(saniye, sonuç)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def run_queries(db_path: str, sql: str, windows: List[tuple], epoch: bool) -> tuple:
+    """Pencereleri sırayla sorgula (önce bir tur ısınma); (ortalama ms, kontrol toplamı)"""
+    conn = sqlite3.connect(db_path)
+    
+    def params(since: datetime, until: datetime, user_id):
+        edges = (int(since.timestamp()), int(until.timestamp())) if epoch else (since.isoformat(" "), until.isoformat(" "))
+        return edges + ((user_id,) if user_id else ())
+    
+    def run():
+        checksum = [0, 0]
+        for since, until, user_id in windows:
+            for row in conn.execute(sql, params(since, until, user_id)):
+                checksum[0] += row[2]
+                checksum[1] += row[3]
+        return tuple(checksum)
+    
+    run()
+    elapsed, checksum = timed(run)
+    conn.close()
+    return elapsed / len(windows) * 1000, checksum
+
+def main():
+    parser = argparse.ArgumentParser(description="usage_logs şema v1 vs v2 benchmark")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--dir", default=None, help="geçici veritabanlarının dizini (varsayılan: sistem temp)")
+    args = parser.parse_args()
+    
+    print("=" * 80)
+    print(f"📊 USAGE SCHEMA BENCHMARK ({args.rows:,} satır, {args.users:,} kullanıcı)")
+    print("=" * 80)
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        v1_path = os.path.join(tmp, "usage_v1.db")
+        v2_path = os.path.join(tmp, "usage_v2.db")
+        
+        build_time, _ = timed(build_v1, v1_path, args.rows, args.users, args.days)
+        print(f"🛠️  v1 veri üretimi: {build_time:.1f}s")
+        
+        # Migration: şema adımı (rename + yeni tablo + rollup doldurma) ve backfill ayrı ölçülür
+        shutil.copy(v1_path, v2_path)
+        init_time, monitor = timed(lambda: UsageMonitor(v2_path, backfill_batch=0))
+        backfill_time, moved = timed(monitor.migrate)
+        print(f"🔁 Şema migration (rollup doldurma dahil): {init_time:.1f}s")
+        print(f"🔁 Backfill: {moved:,} satır, {backfill_time:.1f}s ({moved / max(backfill_time, 1e-9):,.0f} satır/s)")
+        
+        for path in (v1_path, v2_path):
+            conn = sqlite3.connect(path)
+            conn.execute("VACUUM")
+            conn.close()
+        
+        # Sorgu pencereleri: saat sınırlarında (iki şemada da aynı satırları seçer)
+        rng = random.Random(7)
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+        hours = [now - timedelta(hours=rng.randrange(1, args.days * 24)) for _ in range(50)]
+        days = [now - timedelta(days=rng.randrange(1, args.days)) for _ in range(10)]
+        users = [f"user_{rng.randrange(args.users):05d}" for _ in range(200)]
+        scenarios: Dict[str, tuple] = {
+            "Kullanıcı, 30 gün": ("AND user_id = ?", [(now - timedelta(days=args.days), now, user) for user in users]),
+            "Tüm kullanıcılar, 1 saat": ("", [(hour, hour + timedelta(hours=1), None) for hour in hours]),
+            "Tüm kullanıcılar, 1 gün": ("", [(day, day + timedelta(days=1), None) for day in days])
+        }
+        
+        print("-" * 80)
+        print(f"{'':<28} {'v1':>14} {'v2':>14} {'Fark':>10}")
+        print("-" * 80)
+        v1_size = usage_logs_size(v1_path)
+        v2_size = usage_logs_size(v2_path)
+        print(f"{'usage_logs + index (MB)':<28} {v1_size / 1e6:14.1f} {v2_size / 1e6:14.1f} {v1_size / v2_size:9.2f}x")
+        print(f"{'Bayt / satır':<28} {v1_size / args.rows:14.1f} {v2_size / args.rows:14.1f}")
+        
+        for name, (user_filter, windows) in scenarios.items():
+            v1_ms, v1_check = run_queries(v1_path, V1_WINDOW_SQL.format(user_filter=user_filter), windows, epoch=False)
+            v2_ms, v2_check = run_queries(v2_path, V2_WINDOW_SQL.format(user_filter=user_filter), windows, epoch=True)
+            # İki şema aynı satırları toplamalı
+            assert v1_check == v2_check, (name, v1_check, v2_check)
+            print(f"{name + ' (ms)':<28} {v1_ms:14.2f} {v2_ms:14.2f} {v1_ms / v2_ms:9.1f}x")
+    
+    print("-" * 80)
+    print("✅ Benchmark tamamlandı")
+
+if __name__ == "__main__":
+    main()
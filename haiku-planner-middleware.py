@@ -10,11 +10,20 @@ import aiohttp
 import time
 import yaml
 import os
-from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator, Union
+from dataclasses import dataclass, asdict, field
 import tiktoken
 import re
+import hashlib
+import sqlite3
+import threading
+import math
+import random
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 @dataclass
 class ChunkPlan:
@@ -24,6 +33,8 @@ class ChunkPlan:
     inputs_needed: List[str]
     expected_output: str
     max_tokens: int = 2000
+    depends_on: List[int] = field(default_factory=list)  # Önce bitmesi gereken chunk index'leri
+    complexity: Optional[int] = None  # Planner'ın 1-5 zorluk skoru (yoksa yerel heuristic)
 
 @dataclass
 class DecompositionPlan:
@@ -33,6 +44,7 @@ class DecompositionPlan:
     safety: Dict[str, int]
     estimated_cost: float
     total_tokens_estimate: int
+    complete: bool = True  # Streaming planner hâlâ yazıyorsa False
 
 @dataclass
 class ChunkResult:
@@ -45,10 +57,597 @@ class ChunkResult:
     cost: float
     execution_time: float
     error_message: str = ""
+    cache_read_tokens: int = 0  # Upstream prompt cache'ten okunan input token
+    cache_write_tokens: int = 0  # Upstream prompt cache'e yazılan input token
+    timed_out: bool = False  # total_timeout / max_chunk_execution_time aşıldı
+    retryable: bool = False  # Geçici hata (HTTP 429/5xx), tekrar denenebilir
+    retry_after: Optional[float] = None  # Upstream Retry-After (saniye)
+    attempts: int = 1
+    model: str = ""  # Chunk'ı çalıştıran model
+
+class BudgetExceededError(Exception):
+    """Plan tahmini maliyeti istek bütçesini aşıyor"""
+    
+    def __init__(self, message: str, estimated_cost: float, plan_summary: str):
+        super().__init__(message)
+        self.estimated_cost = estimated_cost
+        self.plan_summary = plan_summary
+
+@dataclass
+class RetryBudget:
+    """Tek decomposition isteği için kalan retry hakkı (internal call ve maliyet)"""
+    calls_remaining: int
+    cost_remaining: float
+    
+    def reserve(self, cost: float) -> Tuple[bool, str]:
+        """Bir retry için çağrı ve maliyet ayır"""
+        if self.calls_remaining <= 0:
+            return False, "max_internal_calls reached"
+        if cost > self.cost_remaining:
+            return False, f"remaining cost budget ${self.cost_remaining:.4f} < ${cost:.4f}"
+        self.calls_remaining -= 1
+        self.cost_remaining -= cost
+        return True, ""
+
+@dataclass
+class ContextSegment:
+    """Orijinal istekten ayrılmış bir parça (dosya, kod bloğu veya paragraf grubu)"""
+    name: str
+    text: str
+    position: int
+    tokens: int = 0
+    terms: Counter = field(default_factory=Counter)
+
+class ContextIndex:
+    """Orijinal istek parçaları üzerinde BM25 indeksi"""
+    
+    CODE_BLOCK_RE = re.compile(r"```[^\n]*\n(.*?)```", re.DOTALL)
+    FILE_NAME_RE = re.compile(r"([\w./-]+\.[A-Za-z0-9]{1,8})\b")
+    TERM_RE = re.compile(r"[a-z0-9]+")
+    STOP_WORDS = {
+        "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+        "of", "on", "or", "that", "the", "this", "to", "with", "add", "make", "sure", "should",
+        "must", "all", "new", "update", "implement", "create", "py", "js", "ts"
+    }
+    MIN_RELATIVE_SCORE = 0.25  # En iyi skorun bu oranından düşük parçalar gönderilmez
+    
+    def __init__(self, segments: List[ContextSegment], k1: float = 1.5, b: float = 0.75):
+        self.segments = segments
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(sum(seg.terms.values()) for seg in segments) / len(segments)) if segments else 0.0
+        
+        # Document frequency
+        self.doc_freq: Counter = Counter()
+        for seg in segments:
+            self.doc_freq.update(seg.terms.keys())
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return [term for term in cls.TERM_RE.findall(text.lower()) if term not in cls.STOP_WORDS]
+    
+    @classmethod
+    def build(cls, user_content: str, count_tokens, max_segment_chars: int = 4000) -> "ContextIndex":
+        """İsteği dosya/kod bloğu/paragraf parçalarına ayır ve indeksle"""
+        raw_segments: List[Tuple[str, str]] = []
+        last_end = 0
+        
+        for match in cls.CODE_BLOCK_RE.finditer(user_content):
+            prose = user_content[last_end:match.start()]
+            raw_segments.extend(cls._split_prose(prose, max_segment_chars))
+            
+            # Dosya adı: kod bloğundan hemen önceki satırda veya bloğun ilk satırında
+            preceding_line = prose.rstrip().rsplit("\n", 1)[-1]
+            code = match.group(1)
+            first_line = code.split("\n", 1)[0]
+            name_match = cls.FILE_NAME_RE.search(preceding_line) or cls.FILE_NAME_RE.search(first_line)
+            name = name_match.group(1) if name_match else f"code-block-{len(raw_segments) + 1}"
+            
+            for i, piece in enumerate(cls._split_lines(code, max_segment_chars)):
+                raw_segments.append((name if i == 0 else f"{name}#{i + 1}", piece))
+            last_end = match.end()
+        
+        raw_segments.extend(cls._split_prose(user_content[last_end:], max_segment_chars))
+        
+        segments = []
+        for position, (name, text) in enumerate(raw_segments):
+            name = name or f"text-{position + 1}"
+            terms = Counter(cls.tokenize(name + " " + text))
+            segments.append(ContextSegment(
+                name=name,
+                text=text,
+                position=position,
+                tokens=count_tokens(text),
+                terms=terms
+            ))
+        return cls(segments)
+    
+    @classmethod
+    def _split_prose(cls, text: str, max_chars: int) -> List[Tuple[Optional[str], str]]:
+        """Düz metni boş satırlardan böl, küçük paragrafları birleştir"""
+        parts = []
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if current and len(current) + len(paragraph) > max_chars:
+                parts.append(current)
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current:
+            parts.append(current)
+        
+        # İsimler build() içinde pozisyona göre verilir
+        return [(None, piece) for part in parts for piece in cls._split_lines(part, max_chars)]
+    
+    @staticmethod
+    def _split_lines(text: str, max_chars: int) -> List[str]:
+        """Uzun metni satır sınırlarından max_chars'lık parçalara böl"""
+        if len(text) <= max_chars:
+            return [text]
+        pieces = []
+        current = []
+        size = 0
+        for line in text.split("\n"):
+            if current and size + len(line) + 1 > max_chars:
+                pieces.append("\n".join(current))
+                current = []
+                size = 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            pieces.append("\n".join(current))
+        return pieces
+    
+    def score(self, segment: ContextSegment, query_terms: List[str]) -> float:
+        """BM25 skoru"""
+        n = len(self.segments)
+        length = sum(segment.terms.values())
+        total = 0.0
+        for term in set(query_terms):
+            freq = segment.terms.get(term, 0)
+            if not freq:
+                continue
+            df = self.doc_freq[term]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = freq + self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            total += idf * freq * (self.k1 + 1) / norm
+        return total
+    
+    def pack(self, token_budget: int) -> List[ContextSegment]:
+        """Bütçeye sığan parçaları doküman sırasıyla döndür (chunk'tan bağımsız, deterministik)"""
+        packed = []
+        used_tokens = 0
+        for segment in self.segments:
+            if used_tokens + segment.tokens > token_budget:
+                continue
+            packed.append(segment)
+            used_tokens += segment.tokens
+        return packed
+    
+    def select(self, query: str, file_hints: List[str], token_budget: int) -> List[ContextSegment]:
+        """Sorguya en uygun parçaları token bütçesi içinde seç (orijinal sırayla döner)"""
+        query_terms = self.tokenize(query + " " + " ".join(file_hints))
+        hint_names = {os.path.basename(hint).lower() for hint in file_hints if hint}
+        
+        scored = []
+        for segment in self.segments:
+            # inputs_needed'da adı geçen dosyalar her zaman öncelikli
+            is_hinted = os.path.basename(segment.name.split("#")[0]).lower() in hint_names
+            scored.append((is_hinted, self.score(segment, query_terms), segment))
+        
+        # Zayıf eşleşmeleri at (bütçe boş kalsa da token harcamaya değmez)
+        best = max((score for _, score, _ in scored), default=0.0)
+        scored = [
+            item for item in scored
+            if item[0] or (item[1] > 0 and item[1] >= best * self.MIN_RELATIVE_SCORE)
+        ]
+        
+        scored.sort(key=lambda item: (not item[0], -item[1], item[2].position))
+        
+        selected = []
+        used = 0
+        for _, _, segment in scored:
+            if used + segment.tokens > token_budget:
+                continue
+            selected.append(segment)
+            used += segment.tokens
+        
+        return sorted(selected, key=lambda seg: seg.position)
+
+class PlanStreamParser:
+    """Stream edilen planner JSON'undan chunks[i] objelerini tamamlandıkça çıkaran artımlı parser"""
+    
+    def __init__(self):
+        self.buffer = ""
+        self.summary: Optional[str] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_key: Optional[str] = None  # Üst seviyede son tamamlanan string
+        self._chunks_depth: Optional[int] = None  # "chunks" dizisinin derinliği
+        self._object_start = -1
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Yeni metni ekle; bu parçayla tamamlanan chunk objelerini döndür"""
+        self.buffer += text
+        buf = self.buffer
+        completed = []
+        
+        for pos in range(self._pos, len(buf)):
+            ch = buf[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._on_top_level_string(buf[self._string_start:pos + 1])
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch in '{[':
+                self._depth += 1
+                if ch == '[' and self._depth == 2 and self._last_key == "chunks":
+                    self._chunks_depth = 2
+                elif ch == '{' and self._chunks_depth is not None and self._depth == self._chunks_depth + 1:
+                    self._object_start = pos
+            elif ch in '}]':
+                if ch == '}' and self._object_start >= 0 and self._depth == self._chunks_depth + 1:
+                    try:
+                        chunk_data = json.loads(buf[self._object_start:pos + 1])
+                        if isinstance(chunk_data, dict):
+                            completed.append(chunk_data)
+                    except json.JSONDecodeError:
+                        pass
+                    self._object_start = -1
+                elif ch == ']' and self._depth == self._chunks_depth:
+                    self._chunks_depth = None
+                self._depth -= 1
+        
+        self._pos = len(buf)
+        return completed
+    
+    def _on_top_level_string(self, literal: str):
+        """Üst seviye string: key ise hatırla, "summary" değeri ise sakla"""
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            return
+        if self._last_key == "summary" and self.summary is None:
+            self.summary = value
+        self._last_key = value
+    
+    def result(self) -> Optional[Dict[str, Any]]:
+        """Tüm çıktı geldiyse tam planı parse et (code fence temizlenir)"""
+        text = self.buffer.strip()
+        start, end = text.find('{'), text.rfind('}')
+        if start < 0 or end < start:
+            return None
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+
+class PlanCache:
+    """Decomposition planları için TTL + LRU cache (bellek + opsiyonel SQLite katmanı)"""
+    
+    def __init__(self, ttl: int = 1800, max_entries: int = 256, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        
+        # Sayaçlar
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        
+        if self.db_path:
+            self._init_disk()
+    
+    def _init_disk(self):
+        """Disk katmanı tablosunu oluştur"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS plan_cache (
+                cache_key TEXT PRIMARY KEY,
+                plan_json TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def make_key(user_content: str, model: str, quality: str) -> str:
+        """Kullanıcı içeriği, model ve kaliteden kanonik cache key üret"""
+        # Whitespace farkları aynı plana düşsün
+        normalized = " ".join(user_content.split())
+        raw = json.dumps([normalized, model, quality], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Önce bellekte, sonra diskte ara (disk okuması persist gibi thread'de; event loop bloklanmaz)"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            created_at, plan_data = entry
+            if now - created_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return plan_data
+            del self._entries[key]
+            self.expirations += 1
+        
+        if self.db_path:
+            row, expired = await asyncio.to_thread(self._read_disk, key, now)
+            if expired:
+                self.expirations += 1
+            if row is not None:
+                # Bellek katmanı sadece event loop'tan değişir
+                plan_data = json.loads(row[0])
+                self._put_memory(key, plan_data, row[1])
+                self.disk_hits += 1
+                return plan_data
+        
+        self.misses += 1
+        return None
+    
+    def _read_disk(self, key: str, now: float) -> Tuple[Optional[tuple], bool]:
+        """Disk katmanından (plan_json, created_at) oku; süresi dolmuşsa sil (thread'de çalışır)"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            row = conn.execute(
+                "SELECT plan_json, created_at FROM plan_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            expired = bool(row and now - row[1] > self.ttl)
+            if expired:
+                conn.execute("DELETE FROM plan_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+                row = None
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  Plan cache disk okuma hatası: {e}")
+            return None, False
+        return row, expired
+    
+    def set(self, key: str, plan_data: Dict[str, Any]):
+        """Planı bellek katmanına yaz"""
+        self._put_memory(key, plan_data, time.time())
+    
+    def _put_memory(self, key: str, plan_data: Dict[str, Any], created_at: float):
+        self._entries[key] = (created_at, plan_data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def persist(self, key: str, plan_data: Dict[str, Any]):
+        """Planı disk katmanına yaz (thread'de çağrılabilir)"""
+        if not self.db_path:
+            return
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO plan_cache (cache_key, plan_json, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(plan_data), time.time())
+            )
+            # Süresi dolmuş kayıtları temizle
+            conn.execute("DELETE FROM plan_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  Plan cache disk yazma hatası: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Cache istatistikleri"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk_enabled": bool(self.db_path),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+        }
+
+class TokenCountCache:
+    """Mesaj içeriği hash'i -> token sayısı LRU cache'i (thread-safe)"""
+    
+    def __init__(self, max_entries: int = 50000, min_text_bytes: int = 256):
+        self.max_entries = max_entries
+        self.min_text_bytes = min_text_bytes  # Daha kısa metinleri encode etmek hash'ten ucuz
+        self._entries: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Sayaçlar
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def key_for(self, text: str) -> Optional[bytes]:
+        """Cache'e alınacak kadar uzun metinler için içerik hash'i"""
+        if len(text) < self.min_text_bytes:
+            return None
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    
+    def get(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return count
+    
+    def set(self, key: bytes, count: int):
+        with self._lock:
+            self._entries[key] = count
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+class DecompositionPolicy:
+    """Gözlenen gecikme ve maliyetten öğrenen decompose/direkt kararı.
+    İstekler (input token, max_tokens) bucket'larına ayrılır; her bucket ve yol için EWMA tutulur,
+    maliyet limiti içinde beklenen gecikmesi düşük yol seçilir (epsilon-greedy keşif ile)."""
+    
+    INPUT_TOKEN_EDGES = [2000, 4000, 8000, 16000, 32000, 64000]
+    MAX_TOKEN_EDGES = [2000, 8000, 15000]
+    
+    def __init__(self, threshold: int, max_tokens_threshold: int, max_cost: float,
+                 exploration_rate: float = 0.05, min_samples: int = 20, alpha: float = 0.2,
+                 explore_band: float = 2.0):
+        self.threshold = threshold
+        self.max_tokens_threshold = max_tokens_threshold
+        self.max_cost = max_cost
+        self.exploration_rate = exploration_rate
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.explore_band = explore_band  # Sadece threshold/band .. threshold*band arası keşfedilir
+        self._stats: Dict[Tuple[int, int, bool], Dict[str, float]] = {}
+        
+        # Sayaçlar
+        self.decisions = {"static": 0, "learned": 0, "explore": 0}
+        self.outcomes_recorded = 0
+    
+    def _bucket(self, input_tokens: int, max_tokens: int) -> Tuple[int, int]:
+        return (bisect.bisect_right(self.INPUT_TOKEN_EDGES, input_tokens),
+                bisect.bisect_right(self.MAX_TOKEN_EDGES, max_tokens))
+    
+    def _within_cost(self, bucket: Tuple[int, int], decompose: bool) -> bool:
+        stats = self._stats.get(bucket + (decompose,))
+        return stats is None or stats["cost"] <= self.max_cost
+    
+    def _learned_choice(self, bucket: Tuple[int, int]) -> Optional[bool]:
+        """İki yol için de yeterli örnek varsa maliyet limiti içinde gecikmesi düşük yol"""
+        direct = self._stats.get(bucket + (False,))
+        decomposed = self._stats.get(bucket + (True,))
+        if not direct or not decomposed:
+            return None
+        if direct["samples"] < self.min_samples or decomposed["samples"] < self.min_samples:
+            return None
+        
+        affordable = [(stats["latency"], choice) for choice, stats in ((False, direct), (True, decomposed))
+                      if stats["cost"] <= self.max_cost]
+        if not affordable:
+            # İkisi de limit üstünde: ucuz olanı seç
+            return decomposed["cost"] < direct["cost"]
+        return min(affordable)[1]
+    
+    def decide(self, input_tokens: int, max_tokens: int, static_choice: bool) -> Tuple[bool, str]:
+        """(decompose?, karar kaynağı: static / learned / explore)"""
+        bucket = self._bucket(input_tokens, max_tokens)
+        choice, source = static_choice, "static"
+        learned = self._learned_choice(bucket)
+        if learned is not None:
+            choice, source = learned, "learned"
+        
+        in_band = self.threshold / self.explore_band <= input_tokens <= self.threshold * self.explore_band
+        if in_band and random.random() < self.exploration_rate and self._within_cost(bucket, not choice):
+            choice, source = not choice, "explore"
+        
+        self.decisions[source] += 1
+        return choice, source
+    
+    def record(self, input_tokens: int, max_tokens: int, decomposed: bool, latency: float, cost: float):
+        """Başarılı bir isteğin uçtan uca gecikmesini ve maliyetini modele ekle"""
+        key = self._bucket(input_tokens, max_tokens) + (decomposed,)
+        stats = self._stats.get(key)
+        if stats is None:
+            self._stats[key] = {"samples": 1, "latency": latency, "cost": cost}
+        else:
+            stats["samples"] += 1
+            stats["latency"] += self.alpha * (latency - stats["latency"])
+            stats["cost"] += self.alpha * (cost - stats["cost"])
+        self.outcomes_recorded += 1
+    
+    def _range(self, edges: List[int], index: int) -> List[Optional[int]]:
+        return [edges[index - 1] if index > 0 else 0, edges[index] if index < len(edges) else None]
+    
+    def boundary(self) -> Dict[str, Any]:
+        """Her max_tokens aralığı için bucket bazında güncel karar ve decompose sınırı"""
+        rows = []
+        for mt_index in range(len(self.MAX_TOKEN_EDGES) + 1):
+            max_tokens_range = self._range(self.MAX_TOKEN_EDGES, mt_index)
+            buckets = []
+            decompose_from = None
+            for in_index in range(len(self.INPUT_TOKEN_EDGES) + 1):
+                input_range = self._range(self.INPUT_TOKEN_EDGES, in_index)
+                bucket = (in_index, mt_index)
+                learned = self._learned_choice(bucket)
+                static = input_range[0] >= self.threshold or max_tokens_range[0] >= self.max_tokens_threshold
+                choice = static if learned is None else learned
+                if choice and decompose_from is None:
+                    decompose_from = input_range[0]
+                buckets.append({
+                    "input_tokens": input_range,
+                    "choice": "decompose" if choice else "direct",
+                    "source": "static" if learned is None else "learned",
+                    "direct": self._stats.get(bucket + (False,)),
+                    "decompose": self._stats.get(bucket + (True,))
+                })
+            rows.append({
+                "max_tokens": max_tokens_range,
+                "decompose_from_input_tokens": decompose_from,
+                "buckets": buckets
+            })
+        
+        return {
+            "enabled": True,
+            "static_threshold": self.threshold,
+            "exploration_rate": self.exploration_rate,
+            "explore_band": [int(self.threshold / self.explore_band), int(self.threshold * self.explore_band)],
+            "min_samples": self.min_samples,
+            "max_cost": self.max_cost,
+            "decisions": self.decisions,
+            "outcomes_recorded": self.outcomes_recorded,
+            "boundary": rows
+        }
 
 class HaikuPlannerMiddleware:
     """Haiku Planner Middleware Sınıfı"""
     
+    # task.cancel(msg): decomposition yarışı (x-race) kaybettiği için iptal edildi, client kopmadı
+    RACE_LOSER_CANCEL = "race_loser"
+    
+    # Planner ve tüm chunk çağrılarında birebir aynı kalan ortak kurallar (prompt cache prefix'i)
+    SHARED_SYSTEM_RULES = """You are part of a code-generation pipeline that splits one large coding request into smaller chunks.
+A planner call first designs the chunks; each chunk is then executed by a separate call.
+
+RULES:
+- The original request is given below; treat it as the single source of truth
+- Code changes are returned ONLY as unified diff patches
+- Be concise and precise, do not repeat unchanged code
+- Follow the task-specific instructions in the user message"""
+    
     def __init__(self, litellm_base_url: str, master_key: str, config_path: str = None):
         self.litellm_base_url = litellm_base_url.rstrip('/')
         self.master_key = master_key
@@ -59,6 +658,8 @@ class HaikuPlannerMiddleware:
         
         # Konfigürasyon (config.yaml'dan veya default değerler)
         self.LARGE_REQUEST_THRESHOLD = haiku_config.get('large_request_threshold', 8000)
+        self.MAX_TOKENS_THRESHOLD = haiku_config.get('max_tokens_threshold', 15000)
+        self.AUTO_DECOMPOSE = haiku_config.get('auto_decompose', False)  # false: header'sız istek decompose edilmez
         self.MAX_CHUNKS = haiku_config.get('max_chunks', 3)
         self.MAX_INTERNAL_CALLS = haiku_config.get('max_internal_calls', 4)
         self.PLANNER_MODEL = haiku_config.get('planner_model', 'autox')
@@ -78,13 +679,122 @@ class HaikuPlannerMiddleware:
         self.PLANNER_TIMEOUT = haiku_config.get('planner_timeout', 60)
         self.CHUNK_TIMEOUT = haiku_config.get('chunk_timeout', 120)
         self.TOTAL_TIMEOUT = haiku_config.get('total_timeout', 600)
+        self.MAX_CHUNK_EXECUTION_TIME = haiku_config.get('max_chunk_execution_time', 180)
+        
+        # Planner çıktısını stream et: her chunk planı tamamlanınca execution başlar
+        self.PLANNER_STREAMING = haiku_config.get('planner_streaming', True)
+        
+        # Chunk retry ayarları (config.yaml'dan; sadece HTTP 429/5xx alan chunk tekrar denenir)
+        self.CHUNK_MAX_RETRIES = haiku_config.get('chunk_max_retries', 2)
+        self.RETRY_BASE_DELAY = haiku_config.get('retry_base_delay', 1.0)
+        self.RETRY_MAX_DELAY = haiku_config.get('retry_max_delay', 20.0)
+        self.retry_stats = {
+            "retries": 0,
+            "recovered": 0,  # Retry sonrası başarılı olan chunk'lar
+            "exhausted": 0,  # Retry hakkı bittiği halde başarısız kalanlar
+            "denied_by_call_limit": 0,
+            "denied_by_cost_limit": 0,
+            "denied_by_deadline": 0
+        }
         
         # Maliyet kontrolü (config.yaml'dan)
         self.MAX_COST_PER_REQUEST = haiku_config.get('max_cost_per_request', 1.0)
         self.COST_SAFETY_MARGIN = haiku_config.get('cost_safety_margin', 0.2)
         
-        # Token encoder
-        self.encoder = tiktoken.get_encoding("cl100k_base")
+        # Adaptif decompose kararı (gözlenen gecikme/maliyetten öğrenir, config.yaml'dan)
+        self.ADAPTIVE_DECOMPOSITION = haiku_config.get('adaptive_decomposition', True)
+        self.decomposition_policy = DecompositionPolicy(
+            threshold=self.LARGE_REQUEST_THRESHOLD,
+            max_tokens_threshold=self.MAX_TOKENS_THRESHOLD,
+            max_cost=self.MAX_COST_PER_REQUEST,
+            exploration_rate=haiku_config.get('adaptive_exploration_rate', 0.05),
+            min_samples=haiku_config.get('adaptive_min_samples', 20),
+            alpha=haiku_config.get('adaptive_ewma_alpha', 0.2),
+            explore_band=haiku_config.get('adaptive_explore_band', 2.0)
+        ) if self.ADAPTIVE_DECOMPOSITION else None
+        
+        # Connection pool ayarları (config.yaml'dan)
+        self.CONNECTION_LIMIT = haiku_config.get('connection_limit', 100)
+        self.CONNECTION_LIMIT_PER_HOST = haiku_config.get('connection_limit_per_host', 20)
+        self.DNS_CACHE_TTL = haiku_config.get('dns_cache_ttl', 300)
+        self.KEEPALIVE_TIMEOUT = haiku_config.get('keepalive_timeout', 60)
+        
+        # Plan cache (config.yaml'dan)
+        self.CACHE_PLANS = haiku_config.get('cache_plans', True)
+        self.plan_cache = PlanCache(
+            ttl=haiku_config.get('plan_cache_ttl', 1800),
+            max_entries=haiku_config.get('plan_cache_max_entries', 256),
+            db_path=haiku_config.get('plan_cache_db_path')
+        ) if self.CACHE_PLANS else None
+        
+        # Chunk context seçimi (config.yaml'dan)
+        self.CHUNK_CONTEXT_ENABLED = haiku_config.get('chunk_context_enabled', True)
+        self.CHUNK_CONTEXT_TOKEN_BUDGET = haiku_config.get('chunk_context_token_budget', 3000)
+        self.CONTEXT_SEGMENT_MAX_CHARS = haiku_config.get('context_segment_max_chars', 4000)
+        
+        # Prompt cache uyumlu ortak prefix (config.yaml'dan, x-prompt-cache header'ı ile istek bazında açılır)
+        self.PROMPT_CACHE_PREFIX = haiku_config.get('prompt_cache_prefix', False)
+        self.PROMPT_CACHE_PREFIX_TOKEN_BUDGET = haiku_config.get('prompt_cache_prefix_token_budget', 12000)
+        self.prompt_cache_stats = {
+            "prefixed_calls": 0,  # Ortak prefix ile yapılan planner/chunk çağrıları
+            "cache_hits": 0,  # Cache'ten input okunan çağrılar
+            "cache_read_tokens": 0,
+            "cache_write_tokens": 0
+        }
+        
+        # Paylaşımlı aiohttp session (start() ile açılır, close() ile kapanır)
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Token encoder (load_tokenizer() ile yüklenir; proxy bunu startup'ta çağırır)
+        self.TOKENIZER_ENCODING = haiku_config.get('tokenizer_encoding', 'cl100k_base')
+        self.TOKENIZER_CACHE_DIR = haiku_config.get('tokenizer_cache_dir') or os.getenv('TIKTOKEN_CACHE_DIR')
+        self.TOKENIZER_REQUIRED = haiku_config.get('tokenizer_required', True)
+        self.encoder = None
+        self._tokenizer_load_lock = threading.Lock()
+        self._tokenizer_load_attempted = False
+        
+        # Tokenizer thread pool ayarları (config.yaml'dan)
+        self.TOKENIZER_WORKERS = haiku_config.get('tokenizer_workers', 2)
+        self.TOKENIZER_MAX_QUEUE = haiku_config.get('tokenizer_max_queue', 64)
+        self.MAX_BYTES_PER_TOKEN = haiku_config.get('token_estimate_max_bytes_per_token', 8)
+        self._tokenizer_pool: Optional[ThreadPoolExecutor] = None
+        
+        # Mesaj başına token sayısı cache'i (tekrar gönderilen system prompt / geçmiş için)
+        self.token_cache = TokenCountCache(
+            max_entries=haiku_config.get('token_cache_max_entries', 50000),
+            min_text_bytes=haiku_config.get('token_cache_min_text_bytes', 256)
+        )
+        
+        # Tokenizer metrikleri
+        self.tokenizer_stats = {
+            "decided_by_bounds": 0,  # Encode etmeden karar verilen istekler
+            "encoded": 0,  # Thread pool'da encode edilen istekler
+            "overflow_estimates": 0,  # Kuyruk doluyken tahminle karar verilen istekler
+            "queue_depth": 0,
+            "peak_queue_depth": 0,
+            "total_queue_wait": 0.0,
+            "total_encode_time": 0.0,
+            "encoding": self.TOKENIZER_ENCODING,
+            "loaded": False,
+            "load_time": None,
+            "load_error": None
+        }
+        
+        # İptal metrikleri (client koptuğunda proxy decomposition task'ını iptal eder)
+        self.cancellation_stats = {
+            "requests_cancelled": 0,
+            "race_losers": 0,  # Direkt çağrı yarışı kazandığı için iptal edilen decomposition'lar
+            "chunks_cancelled": 0  # Upstream'de çalışırken iptal edilen chunk çağrıları
+        }
+        
+        # Chunk bazında model seçimi (x-quality: auto, config.yaml'dan)
+        self.DEEP_COMPLEXITY_THRESHOLD = haiku_config.get('deep_complexity_threshold', 4)
+        self.routing_stats = {
+            "fast_chunks": 0,
+            "deep_chunks": 0,
+            "planner_scored": 0,  # Skoru planner'dan gelen chunk'lar
+            "heuristic_scored": 0  # Skoru yerel heuristic'ten gelen chunk'lar
+        }
         
         # Model maliyetleri (USD/1M token)
         self.model_costs = {
@@ -117,54 +827,226 @@ class HaikuPlannerMiddleware:
             print(f"⚠️  Config yükleme hatası: {e}, default değerler kullanılıyor")
             return {}
     
+    async def start(self):
+        """Paylaşımlı HTTP session'ı aç (proxy startup'ında çağrılır)"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.CONNECTION_LIMIT,
+            limit_per_host=self.CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=self.DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=self.KEEPALIVE_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": f"Bearer {self.master_key}",
+                "Content-Type": "application/json"
+            }
+        )
+        print(f"✅ Haiku Planner HTTP session açıldı (limit_per_host={self.CONNECTION_LIMIT_PER_HOST})")
+    
+    async def close(self):
+        """Paylaşımlı HTTP session'ı kapat (proxy shutdown'ında çağrılır)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        
+        if self._tokenizer_pool is not None:
+            self._tokenizer_pool.shutdown(wait=False)
+            self._tokenizer_pool = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Paylaşımlı session'ı döndür, açık değilse aç"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    def load_tokenizer(self) -> float:
+        """BPE dosyasını yerel cache'ten yükle ve bir warm-up encode yap; geçen süreyi döner"""
+        with self._tokenizer_load_lock:
+            if self.encoder is not None:
+                return self.tokenizer_stats["load_time"] or 0.0
+            self._tokenizer_load_attempted = True
+            
+            # tiktoken BPE dosyasını TIKTOKEN_CACHE_DIR'dan okur (Docker image'ında önceden indirilir)
+            if self.TOKENIZER_CACHE_DIR:
+                os.environ['TIKTOKEN_CACHE_DIR'] = self.TOKENIZER_CACHE_DIR
+            
+            start_time = time.time()
+            try:
+                encoder = tiktoken.get_encoding(self.TOKENIZER_ENCODING)
+                # İlk encode regex derlemesini tetikler, ilk büyük istek beklemesin
+                encoder.encode("def warm_up(x):\n    return x  # ısınma")
+            except Exception as e:
+                load_time = time.time() - start_time
+                self.tokenizer_stats["load_error"] = str(e)
+                if self.TOKENIZER_REQUIRED:
+                    raise RuntimeError(
+                        f"Tokenizer yüklenemedi ({self.TOKENIZER_ENCODING}, "
+                        f"cache_dir={self.TOKENIZER_CACHE_DIR}): {e}"
+                    )
+                print(f"⚠️  Tokenizer yüklenemedi, len(text)//4 tahmini kullanılacak: {e}")
+                return load_time
+            
+            load_time = time.time() - start_time
+            self.encoder = encoder
+            self.tokenizer_stats["loaded"] = True
+            self.tokenizer_stats["load_time"] = load_time
+            return load_time
+    
     def count_tokens(self, text: str) -> int:
-        """Token sayısını hesapla"""
+        """Token sayısını hesapla (uzun metinler içerik hash'ine göre cache'lenir)"""
+        key = self.token_cache.key_for(text)
+        if key is not None:
+            cached = self.token_cache.get(key)
+            if cached is not None:
+                return cached
+        return self._encode_and_cache(text, key)
+    
+    def _encode_and_cache(self, text: str, key: Optional[bytes]) -> int:
+        """Metni encode et ve (key varsa) sonucu cache'e yaz"""
+        if self.encoder is None and not self._tokenizer_load_attempted:
+            self.load_tokenizer()
+        
         try:
-            return len(self.encoder.encode(text))
+            count = len(self.encoder.encode(text))
         except:
             # Fallback: karakter sayısının 1/4'ü
             return len(text) // 4
+        
+        if key is not None:
+            self.token_cache.set(key, count)
+        return count
+    
+    def _message_texts(self, request_data: Dict[str, Any]) -> List[str]:
+        """Mesajlardaki tüm text içeriklerini topla"""
+        texts = []
+        for message in request_data.get('messages', []):
+            content = message.get('content', '')
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get('type') == 'text':
+                        texts.append(item.get('text', ''))
+        return texts
+    
+    def _get_tokenizer_pool(self) -> ThreadPoolExecutor:
+        """Tokenizer thread pool'unu döndür, yoksa oluştur"""
+        if self._tokenizer_pool is None:
+            self._tokenizer_pool = ThreadPoolExecutor(
+                max_workers=self.TOKENIZER_WORKERS,
+                thread_name_prefix="tokenizer"
+            )
+        return self._tokenizer_pool
     
-    def should_decompose(self, request_data: Dict[str, Any], headers: Dict[str, str]) -> bool:
-        """İsteğin decompose edilip edilmeyeceğini kontrol et (MVP: Otomatik büyük istekler için)"""
+    def _timed_count(self, texts: List[Tuple[str, Optional[bytes]]], submitted_at: float) -> int:
+        """Thread pool içinde çalışır: kuyrukta bekleme ve encode süresini ölç"""
+        started_at = time.time()
+        self.tokenizer_stats["total_queue_wait"] += started_at - submitted_at
+        total = sum(self._encode_and_cache(text, key) for text, key in texts)
+        self.tokenizer_stats["total_encode_time"] += time.time() - started_at
+        return total
+    
+    async def should_decompose_async(self, request_data: Dict[str, Any], headers: Dict[str, str]) -> bool:
+        """İsteğin decompose edilip edilmeyeceği: header override, sabit eşikler ve (açıksa) adaptif karar.
+        Tokenizasyon event loop'u bloklamaz (thread pool)."""
         
-        # Header kontrolü (manuel override)
+        # Header kontrolleri ucuz, tokenizasyon gerektirmez; manuel override her zaman geçerli
         if headers.get('x-decompose') == '1':
             return True
-        
-        # Header ile devre dışı bırakma
         if headers.get('x-decompose') == '0':
             return False
         
-        # MVP: max_tokens threshold kontrolü (büyük output için)
-        max_tokens = request_data.get('max_tokens', 0)
-        if max_tokens >= 15000:  # 15K+ token output isteği
+        static_choice = await self._static_should_decompose_async(request_data)
+        if self.decomposition_policy is None:
+            return static_choice
+        
+        input_tokens, max_tokens = self._policy_features(request_data)
+        decompose, _ = self.decomposition_policy.decide(input_tokens, max_tokens, static_choice)
+        return decompose
+    
+    def _policy_features(self, request_data: Dict[str, Any]) -> Tuple[int, int]:
+        """Adaptif karar için ucuz özellikler: byte/4 input token tahmini ve max_tokens"""
+        input_tokens = sum(len(text.encode('utf-8')) for text in self._message_texts(request_data)) // 4
+        return input_tokens, request_data.get('max_tokens') or 0
+    
+    def record_outcome(self, request_data: Dict[str, Any], decomposed: bool, latency: float,
+                       cost: Optional[float] = None, usage: Optional[Dict[str, Any]] = None):
+        """Başarılı bir isteğin gecikme/maliyetini adaptif karara bildir"""
+        if self.decomposition_policy is None:
+            return
+        if cost is None:
+            total_tokens = (usage or {}).get('total_tokens', 0)
+            cost_per_token = self.model_costs.get(request_data.get('model', 'autox'), 10.0) / 1_000_000
+            cost = total_tokens * cost_per_token
+        input_tokens, max_tokens = self._policy_features(request_data)
+        self.decomposition_policy.record(input_tokens, max_tokens, decomposed, latency, cost)
+    
+    async def _static_should_decompose_async(self, request_data: Dict[str, Any]) -> bool:
+        """Sabit eşiklerle karar: max_tokens ve input token sayısı"""
+        if (request_data.get('max_tokens') or 0) >= self.MAX_TOKENS_THRESHOLD:
             return True
         
-        # Token threshold kontrolü (input için)
-        messages = request_data.get('messages', [])
+        texts = self._message_texts(request_data)
+        total_bytes = sum(len(text.encode('utf-8')) for text in texts)
+        
+        # Byte sınırları: her token en az 1 byte'tır, pratikte MAX_BYTES_PER_TOKEN'dan uzun token nadirdir
+        if total_bytes <= self.LARGE_REQUEST_THRESHOLD:
+            self.tokenizer_stats["decided_by_bounds"] += 1
+            return False
+        if total_bytes / self.MAX_BYTES_PER_TOKEN > self.LARGE_REQUEST_THRESHOLD:
+            self.tokenizer_stats["decided_by_bounds"] += 1
+            return True
+        
+        # Kuyruk doluysa beklemek yerine byte tahmini ile karar ver
+        if self.tokenizer_stats["queue_depth"] >= self.TOKENIZER_MAX_QUEUE:
+            self.tokenizer_stats["overflow_estimates"] += 1
+            return total_bytes // 4 > self.LARGE_REQUEST_THRESHOLD
+        
+        # Daha önce sayılmış mesajları (system prompt, konuşma geçmişi) cache'ten topla,
+        # sadece yeni mesajları thread pool'a gönder
         total_tokens = 0
+        uncached_texts = []
+        for text in texts:
+            key = self.token_cache.key_for(text)
+            cached = self.token_cache.get(key) if key is not None else None
+            if cached is not None:
+                total_tokens += cached
+            else:
+                uncached_texts.append((text, key))
         
-        for message in messages:
-            content = message.get('content', '')
-            if isinstance(content, str):
-                total_tokens += self.count_tokens(content)
-            elif isinstance(content, list):
-                for item in content:
-                    if isinstance(item, dict) and item.get('type') == 'text':
-                        total_tokens += self.count_tokens(item.get('text', ''))
+        if not uncached_texts:
+            return total_tokens > self.LARGE_REQUEST_THRESHOLD
+        
+        stats = self.tokenizer_stats
+        stats["queue_depth"] += 1
+        stats["peak_queue_depth"] = max(stats["peak_queue_depth"], stats["queue_depth"])
+        try:
+            loop = asyncio.get_running_loop()
+            total_tokens += await loop.run_in_executor(
+                self._get_tokenizer_pool(), self._timed_count, uncached_texts, time.time()
+            )
+        finally:
+            stats["queue_depth"] -= 1
+        stats["encoded"] += 1
         
-        # MVP: 8000+ token input veya büyük istekler için otomatik aktif
         return total_tokens > self.LARGE_REQUEST_THRESHOLD
     
-    async def create_plan(self, original_request: Dict[str, Any], headers: Dict[str, str] = None) -> DecompositionPlan:
-        """Haiku ile decomposition planı oluştur"""
-        
-        # Orijinal mesajları analiz et
-        messages = original_request.get('messages', [])
+    def estimate_direct_cost(self, request_data: Dict[str, Any]) -> float:
+        """Decompose etmeden tek direkt çağrının kaba maliyet tahmini (byte/4 input + max_tokens output)"""
+        input_tokens = sum(len(text.encode('utf-8')) for text in self._message_texts(request_data)) // 4
+        output_tokens = request_data.get('max_tokens') or 4096
+        cost_per_token = self.model_costs.get(request_data.get('model', 'autox'), 10.0) / 1_000_000
+        return (input_tokens + output_tokens) * cost_per_token
+    
+    def _user_content(self, request_data: Dict[str, Any]) -> str:
+        """User mesajlarının text içeriklerini birleştir"""
         user_content = ""
-        
-        for message in messages:
+        for message in request_data.get('messages', []):
             if message.get('role') == 'user':
                 content = message.get('content', '')
                 if isinstance(content, str):
@@ -173,13 +1055,124 @@ class HaikuPlannerMiddleware:
                     for item in content:
                         if isinstance(item, dict) and item.get('type') == 'text':
                             user_content += item.get('text', '') + "\n"
+        return user_content
+    
+    async def build_context_index(self, request_data: Dict[str, Any]) -> Optional[ContextIndex]:
+        """Orijinal isteği chunk context seçimi için indeksle (event loop dışında)"""
+        if not self.CHUNK_CONTEXT_ENABLED:
+            return None
+        user_content = self._user_content(request_data)
+        if not user_content.strip():
+            return None
+        return await asyncio.to_thread(
+            ContextIndex.build, user_content, self.count_tokens, self.CONTEXT_SEGMENT_MAX_CHARS
+        )
+    
+    def _prompt_cache_prefix_enabled(self, headers: Optional[Dict[str, str]]) -> bool:
+        """Ortak prefix modu: x-prompt-cache header'ı config'i ezer"""
+        header = (headers or {}).get('x-prompt-cache')
+        if header is not None:
+            return header == "1"
+        return self.PROMPT_CACHE_PREFIX
+    
+    def build_shared_prefix(self, request_data: Dict[str, Any],
+                            context_index: Optional[ContextIndex]) -> str:
+        """Ortak kurallar + paketlenmiş orijinal context. Aynı istek için planner ve her chunk'ta byte-byte aynıdır."""
+        if context_index is not None:
+            context_parts = [
+                f"### {seg.name}\n```\n{seg.text}\n```"
+                for seg in context_index.pack(self.PROMPT_CACHE_PREFIX_TOKEN_BUDGET)
+            ]
+            original_context = "\n\n".join(context_parts)
+        else:
+            # Indeks yoksa (chunk_context_enabled: false) bütçeyi karakter tahminiyle uygula
+            original_context = self._user_content(request_data)[:self.PROMPT_CACHE_PREFIX_TOKEN_BUDGET * 4]
+        return f"{self.SHARED_SYSTEM_RULES}\n\nORIGINAL REQUEST:\n\n{original_context}"
+    
+    def _prefixed_messages(self, shared_prefix: str, prompt: str) -> List[Dict[str, Any]]:
+        """Ortak prefix'i cache_control ile işaretli system mesajı olarak öne, göreve özel prompt'u sona koy"""
+        return [
+            {
+                "role": "system",
+                "content": [{
+                    "type": "text",
+                    "text": shared_prefix,
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            },
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _record_prompt_cache_usage(self, usage: Dict[str, Any], prefixed: bool) -> Tuple[int, int]:
+        """Upstream usage bloğundan cache okuma/yazma token'larını al ve metriklere ekle"""
+        prompt_details = usage.get('prompt_tokens_details') or {}
+        cache_read = usage.get('cache_read_input_tokens') or prompt_details.get('cached_tokens') or 0
+        cache_write = usage.get('cache_creation_input_tokens') or 0
+        
+        if prefixed:
+            self.prompt_cache_stats["prefixed_calls"] += 1
+        if cache_read:
+            self.prompt_cache_stats["cache_hits"] += 1
+        self.prompt_cache_stats["cache_read_tokens"] += cache_read
+        self.prompt_cache_stats["cache_write_tokens"] += cache_write
+        return cache_read, cache_write
+    
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        """Deadline'a kalan süre (time.monotonic bazlı, deadline yoksa None)"""
+        if deadline is None:
+            return None
+        return max(deadline - time.monotonic(), 0.0)
+    
+    def _timed_out_result(self, chunk: ChunkPlan, chunk_id: int, execution_time: float,
+                          reason: str) -> ChunkResult:
+        """Süresi dolan chunk için başarısız ChunkResult"""
+        return ChunkResult(
+            chunk_id=chunk_id,
+            title=chunk.title,
+            success=False,
+            content="",
+            tokens_used=0,
+            cost=0.0,
+            execution_time=execution_time,
+            error_message=f"Timed out: {reason}",
+            timed_out=True
+        )
+    
+    def _plan_cache_key(self, original_request: Dict[str, Any], headers: Optional[Dict[str, str]],
+                        user_content: str) -> Optional[str]:
+        """Plan cache key'i (aynı içerik + model + kalite); cache kapalıysa None"""
+        if self.plan_cache is None:
+            return None
+        quality = self._request_quality(original_request, headers)
+        return PlanCache.make_key(user_content, original_request.get('model', 'autox'), quality)
+    
+    def _request_quality(self, original_request: Dict[str, Any], headers: Optional[Dict[str, str]]) -> str:
+        """x-quality header'ı (fast / deep / auto), yoksa request'teki quality"""
+        return (headers or {}).get('x-quality') or original_request.get('quality', 'fast')
+    
+    def _planner_request(self, user_content: str, shared_prefix: Optional[str],
+                         stream: bool = False) -> Dict[str, Any]:
+        """Planner çağrısının body'si"""
+        
+        # Planner sadece ilk 4000 karakteri görür; istekteki tüm dosya adlarını ayrıca listele
+        files_section = ""
+        if len(user_content) > 4000:
+            file_names = ContextIndex.FILE_NAME_RE.findall(user_content)
+            unique_names = list(dict.fromkeys(file_names))[:50]
+            if unique_names:
+                files_section = f"\nFILES REFERENCED IN THE FULL REQUEST: {', '.join(unique_names)}\n"
+        
+        # Ortak prefix modunda orijinal istek system mesajında (cache'lenen kısım)
+        if shared_prefix:
+            request_section = "The original request is provided in the system message."
+        else:
+            request_section = f"ORIGINAL REQUEST:\n{user_content[:4000]}..."
         
         # Planner prompt
         planner_prompt = f"""Analyze this large coding request and create a decomposition plan.
 
-ORIGINAL REQUEST:
-{user_content[:4000]}...
-
+{request_section}
+{files_section}
 Create a JSON plan with this exact structure:
 {{
   "summary": "Brief description of the task (max 10 lines)",
@@ -189,7 +1182,9 @@ Create a JSON plan with this exact structure:
       "goal": "What this chunk should accomplish",
       "inputs_needed": ["file1.py", "config.yaml"],
       "expected_output": "Description of expected diff patches",
-      "max_tokens": 2000
+      "max_tokens": 2000,
+      "depends_on": [],
+      "complexity": 2
     }}
   ],
   "safety": {{
@@ -202,134 +1197,344 @@ Create a JSON plan with this exact structure:
 CONSTRAINTS:
 - Maximum 3 chunks
 - Each chunk must produce unified diff patches only
+- "depends_on" lists the 0-based indexes of earlier chunks whose output this chunk needs as input
+- Leave "depends_on" empty for independent chunks so they can run in parallel
+- "complexity" rates how hard the chunk is, 1-5: 1 = trivial (rename, config, boilerplate),
+  3 = ordinary feature work, 5 = subtle logic (algorithms, concurrency, cross-file refactors)
 - Focus on the most critical parts first
 - Estimate tokens conservatively
 - If request is too complex, suggest scope reduction
 
 Return ONLY the JSON, no other text."""
 
-        # Planner çağrısı (MVP: stream=false)
+        if shared_prefix:
+            planner_messages = self._prefixed_messages(shared_prefix, planner_prompt)
+        else:
+            planner_messages = [{"role": "user", "content": planner_prompt}]
+        
         planner_request = {
             "model": self.PLANNER_MODEL,
-            "messages": [
-                {"role": "user", "content": planner_prompt}
-            ],
+            "messages": planner_messages,
             "max_tokens": 1000,
             "temperature": 0.1,
-            "stream": False  # MVP: Streaming kapalı
+            "stream": stream
         }
+        if stream:
+            # Prompt cache metrikleri için son event'te usage iste
+            planner_request["stream_options"] = {"include_usage": True}
+        return planner_request
+    
+    def _planner_timeout(self, deadline: Optional[float]) -> aiohttp.ClientTimeout:
+        """Planner için timeout (config.yaml'dan, toplam deadline'a kalan süreyle sınırlı)"""
+        planner_timeout = self.PLANNER_TIMEOUT
+        remaining = self._remaining(deadline)
+        if remaining is not None:
+            if remaining <= 0:
+                raise Exception(f"Total timeout ({self.TOTAL_TIMEOUT}s) exceeded before planning")
+            planner_timeout = min(planner_timeout, remaining)
+        return aiohttp.ClientTimeout(total=planner_timeout)
+    
+    def _chunk_from_dict(self, chunk_data: Dict[str, Any]) -> ChunkPlan:
+        """Planner çıktısındaki chunk'ı ChunkPlan'a dönüştür (Maliyet optimizasyonu ile)"""
+        # Maliyet optimizasyonu: Chunk boyutunu optimize et
+        requested_tokens = chunk_data.get('max_tokens', 2000)
+        if self.COST_OPTIMIZATION_ENABLED:
+            # Optimal chunk size'a yaklaştır (daha küçük = daha ucuz)
+            optimal_tokens = min(
+                max(requested_tokens, self.MIN_CHUNK_SIZE),
+                self.OPTIMAL_CHUNK_SIZE  # 1500 token optimal
+            )
+        else:
+            optimal_tokens = min(requested_tokens, self.MAX_CHUNK_SIZE)
         
-        # Planner için timeout (config.yaml'dan)
-        timeout = aiohttp.ClientTimeout(total=self.PLANNER_TIMEOUT)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                f"{self.litellm_base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.master_key}",
-                    "Content-Type": "application/json"
-                },
-                json=planner_request
-            ) as response:
+        # Planner'ın zorluk skoru: 1-5 dışı veya sayı olmayan değerler yok sayılır
+        complexity = chunk_data.get('complexity')
+        if isinstance(complexity, bool) or not isinstance(complexity, (int, float)) or not 1 <= complexity <= 5:
+            complexity = None
+        
+        return ChunkPlan(
+            title=chunk_data.get('title', ''),
+            goal=chunk_data.get('goal', ''),
+            inputs_needed=chunk_data.get('inputs_needed', []),
+            expected_output=chunk_data.get('expected_output', ''),
+            max_tokens=optimal_tokens,
+            depends_on=chunk_data.get('depends_on') or [],
+            complexity=round(complexity) if complexity is not None else None
+        )
+    
+    def _planner_cost(self) -> float:
+        """Planner maliyeti (Haiku - ucuz)"""
+        return 1000 * (self.model_costs.get(self.PLANNER_MODEL, 3.0) / 1_000_000)
+    
+    def _chunk_cost_estimate(self, chunk: ChunkPlan, quality: str) -> float:
+        """Chunk maliyet tahmini (optimize edilmiş boyutla, chunk'ı çalıştıracak modelin fiyatıyla)"""
+        exec_model = self._execution_model(quality, chunk)
+        exec_cost_per_token = self.model_costs.get(exec_model, 3.0) / 1_000_000
+        return chunk.max_tokens * exec_cost_per_token
+    
+    def _report_savings(self, original_request: Dict[str, Any], estimated_tokens: int,
+                        estimated_cost: float):
+        """Maliyet optimizasyonu uyarısı"""
+        if not self.COST_OPTIMIZATION_ENABLED:
+            return
+        
+        # Normal maliyet (optimizasyon olmadan)
+        model = original_request.get('model', 'autox')
+        cost_per_token = self.model_costs.get(model, 10.0) / 1_000_000
+        normal_cost = estimated_tokens * cost_per_token
+        savings = normal_cost - estimated_cost
+        savings_percent = (savings / normal_cost * 100) if normal_cost > 0 else 0
+        
+        if savings_percent > 0:
+            print(f"💰 Maliyet optimizasyonu: ${savings:.4f} tasarruf (%{savings_percent:.1f})")
+    
+    async def _store_plan(self, cache_key: Optional[str], plan: DecompositionPlan):
+        """Planı cache'e yaz"""
+        if cache_key is None:
+            return
+        plan_dict = asdict(plan)
+        self.plan_cache.set(cache_key, plan_dict)
+        if self.plan_cache.db_path:
+            await asyncio.to_thread(self.plan_cache.persist, cache_key, plan_dict)
+    
+    async def create_plan(self, original_request: Dict[str, Any], headers: Dict[str, str] = None,
+                          shared_prefix: Optional[str] = None,
+                          deadline: Optional[float] = None) -> DecompositionPlan:
+        """Haiku ile decomposition planı oluştur (shared_prefix verilirse orijinal istek prefix'ten okunur)"""
+        
+        # Orijinal mesajları analiz et
+        user_content = self._user_content(original_request)
+        
+        # Plan cache kontrolü (aynı içerik + model + kalite için planner çağrısını atla)
+        cache_key = self._plan_cache_key(original_request, headers, user_content)
+        if cache_key is not None:
+            cached_plan = await self.plan_cache.get(cache_key)
+            if cached_plan is not None:
+                print("♻️ Plan cache hit")
+                return self._plan_from_dict(cached_plan)
+        
+        planner_request = self._planner_request(user_content, shared_prefix)
+        timeout = self._planner_timeout(deadline)
+        session = await self._get_session()
+        async with session.post(
+            f"{self.litellm_base_url}/chat/completions",
+            json=planner_request,
+            timeout=timeout
+        ) as response:
+            
+            if response.status != 200:
+                raise Exception(f"Planner call failed: {response.status}")
+            
+            result = await response.json()
+            plan_text = result['choices'][0]['message']['content']
+            self._record_prompt_cache_usage(result.get('usage') or {}, bool(shared_prefix))
+            
+            # JSON parse
+            try:
+                # JSON'u temizle
+                plan_text = plan_text.strip()
+                if plan_text.startswith('```json'):
+                    plan_text = plan_text[7:]
+                if plan_text.endswith('```'):
+                    plan_text = plan_text[:-3]
                 
-                if response.status != 200:
-                    raise Exception(f"Planner call failed: {response.status}")
+                plan_data = json.loads(plan_text)
                 
-                result = await response.json()
-                plan_text = result['choices'][0]['message']['content']
+                # ChunkPlan objelerine dönüştür (Maliyet optimizasyonu ile)
+                chunks = [
+                    self._chunk_from_dict(chunk_data)
+                    for chunk_data in plan_data.get('chunks', [])[:self.MAX_CHUNKS]
+                ]
+                self._normalize_dependencies(chunks)
+                
+                safety = plan_data.get('safety', {})
+                estimated_tokens = safety.get('estimated_total_tokens', 6000)
+                
+                # Maliyet hesapla (Optimize edilmiş chunk'lar ile)
+                quality = self._request_quality(original_request, headers)
+                estimated_cost = self._planner_cost() + sum(
+                    self._chunk_cost_estimate(chunk, quality) for chunk in chunks
+                )
+                self._report_savings(original_request, estimated_tokens, estimated_cost)
+                
+                plan = DecompositionPlan(
+                    summary=plan_data.get('summary', ''),
+                    chunks=chunks,
+                    safety=safety,
+                    estimated_cost=estimated_cost,
+                    total_tokens_estimate=estimated_tokens
+                )
+                
+                await self._store_plan(cache_key, plan)
+                return plan
+                
+            except json.JSONDecodeError as e:
+                raise Exception(f"Invalid JSON from planner: {e}")
+    
+    async def create_plan_stream(self, original_request: Dict[str, Any], headers: Dict[str, str],
+                                 plan: DecompositionPlan,
+                                 shared_prefix: Optional[str] = None,
+                                 deadline: Optional[float] = None) -> AsyncIterator[ChunkPlan]:
+        """Planner'ı stream et; her chunks[i] JSON objesi tamamlanır tamamlanmaz ChunkPlan olarak döner.
+        summary/safety/maliyet tahmini plan üzerine yazılır, planner bitince plan.complete = True olur."""
+        
+        user_content = self._user_content(original_request)
+        max_cost = original_request.get('max_cost')
+        quality = self._request_quality(original_request, headers)
+        plan.estimated_cost = self._planner_cost()
+        
+        # Plan cache hit: tüm chunk'lar hemen hazır
+        cache_key = self._plan_cache_key(original_request, headers, user_content)
+        if cache_key is not None:
+            cached_plan = await self.plan_cache.get(cache_key)
+            if cached_plan is not None:
+                print("♻️ Plan cache hit")
+                cached = self._plan_from_dict(cached_plan)
+                budget_ok, budget_msg = self.check_budget_limits(cached.estimated_cost, max_cost)
+                if not budget_ok:
+                    raise BudgetExceededError(budget_msg, cached.estimated_cost, cached.summary)
+                plan.summary = cached.summary
+                plan.safety = cached.safety
+                plan.estimated_cost = cached.estimated_cost
+                plan.total_tokens_estimate = cached.total_tokens_estimate
+                plan.complete = True
+                for chunk in cached.chunks:
+                    yield chunk
+                return
+        
+        planner_request = self._planner_request(user_content, shared_prefix, stream=True)
+        timeout = self._planner_timeout(deadline)
+        parser = PlanStreamParser()
+        chunks: List[ChunkPlan] = []
+        budget_truncated = False
+        
+        session = await self._get_session()
+        async with session.post(
+            f"{self.litellm_base_url}/chat/completions",
+            json=planner_request,
+            timeout=timeout
+        ) as response:
+            
+            if response.status != 200:
+                raise Exception(f"Planner call failed: {response.status}")
+            
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
                 
-                # JSON parse
                 try:
-                    # JSON'u temizle
-                    plan_text = plan_text.strip()
-                    if plan_text.startswith('```json'):
-                        plan_text = plan_text[7:]
-                    if plan_text.endswith('```'):
-                        plan_text = plan_text[:-3]
-                    
-                    plan_data = json.loads(plan_text)
-                    
-                    # ChunkPlan objelerine dönüştür (Maliyet optimizasyonu ile)
-                    chunks = []
-                    for chunk_data in plan_data.get('chunks', [])[:self.MAX_CHUNKS]:
-                        # Maliyet optimizasyonu: Chunk boyutunu optimize et
-                        requested_tokens = chunk_data.get('max_tokens', 2000)
-                        if self.COST_OPTIMIZATION_ENABLED:
-                            # Optimal chunk size'a yaklaştır (daha küçük = daha ucuz)
-                            optimal_tokens = min(
-                                max(requested_tokens, self.MIN_CHUNK_SIZE),
-                                self.OPTIMAL_CHUNK_SIZE  # 1500 token optimal
-                            )
-                        else:
-                            optimal_tokens = min(requested_tokens, self.MAX_CHUNK_SIZE)
-                        
-                        chunks.append(ChunkPlan(
-                            title=chunk_data.get('title', ''),
-                            goal=chunk_data.get('goal', ''),
-                            inputs_needed=chunk_data.get('inputs_needed', []),
-                            expected_output=chunk_data.get('expected_output', ''),
-                            max_tokens=optimal_tokens
-                        ))
-                    
-                    safety = plan_data.get('safety', {})
-                    estimated_tokens = safety.get('estimated_total_tokens', 6000)
-                    
-                    # Maliyet hesapla (Optimize edilmiş chunk'lar ile)
-                    model = original_request.get('model', 'autox')
-                    cost_per_token = self.model_costs.get(model, 10.0) / 1_000_000
-                    
-                    # Planner maliyeti (Haiku - ucuz)
-                    planner_cost = 1000 * (self.model_costs.get(self.PLANNER_MODEL, 3.0) / 1_000_000)
-                    
-                    # Chunk maliyetleri (optimize edilmiş boyutlarla)
-                    chunk_costs = []
-                    for chunk in chunks:
-                        # Execution model seçimi (quality header'a göre)
-                        quality = original_request.get('quality', 'fast')
-                        if quality == 'deep':
-                            exec_model = model
-                        else:
-                            exec_model = self.PLANNER_MODEL  # Fast için Haiku (ucuz)
-                        
-                        exec_cost_per_token = self.model_costs.get(exec_model, 3.0) / 1_000_000
-                        chunk_cost = chunk.max_tokens * exec_cost_per_token
-                        chunk_costs.append(chunk_cost)
-                    
-                    # Toplam maliyet
-                    estimated_cost = planner_cost + sum(chunk_costs)
-                    
-                    # Maliyet optimizasyonu uyarısı
-                    if self.COST_OPTIMIZATION_ENABLED:
-                        # Normal maliyet (optimizasyon olmadan)
-                        normal_cost = estimated_tokens * cost_per_token
-                        savings = normal_cost - estimated_cost
-                        savings_percent = (savings / normal_cost * 100) if normal_cost > 0 else 0
-                        
-                        if savings_percent > 0:
-                            print(f"💰 Maliyet optimizasyonu: ${savings:.4f} tasarruf (%{savings_percent:.1f})")
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if event.get('usage'):
+                    self._record_prompt_cache_usage(event['usage'], bool(shared_prefix))
+                choices = event.get('choices') or []
+                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                if not delta:
+                    continue
+                
+                for chunk_data in parser.feed(delta):
+                    if len(chunks) >= self.MAX_CHUNKS:
+                        continue
+                    chunk = self._chunk_from_dict(chunk_data)
+                    # Akışta sadece önceki chunk'lara bağımlılık olabilir (döngü imkansız)
+                    chunk.depends_on = [
+                        dep for dep in dict.fromkeys(chunk.depends_on)
+                        if isinstance(dep, int) and 0 <= dep < len(chunks)
+                    ]
                     
-                    return DecompositionPlan(
-                        summary=plan_data.get('summary', ''),
-                        chunks=chunks,
-                        safety=safety,
-                        estimated_cost=estimated_cost,
-                        total_tokens_estimate=estimated_tokens
-                    )
+                    chunk_cost = self._chunk_cost_estimate(chunk, quality)
+                    budget_ok, budget_msg = self.check_budget_limits(plan.estimated_cost + chunk_cost, max_cost)
+                    if not budget_ok:
+                        if not chunks:
+                            raise BudgetExceededError(budget_msg, plan.estimated_cost + chunk_cost,
+                                                      parser.summary or "")
+                        # Başlamış chunk'lar var: kalan chunk'ları kes (scope reduction)
+                        print(f"⚠️  Budget reached after {len(chunks)} chunk(s), remaining chunks dropped")
+                        budget_truncated = True
+                        break
                     
-                except json.JSONDecodeError as e:
-                    raise Exception(f"Invalid JSON from planner: {e}")
+                    plan.estimated_cost += chunk_cost
+                    chunks.append(chunk)
+                    yield chunk
+                
+                if budget_truncated:
+                    # Planner'ın geri kalanını beklemeye gerek yok (bağlantı kapanır)
+                    break
+        
+        # Planner tamamlandı: özet ve safety bloğu
+        plan_data = parser.result() or {}
+        plan.summary = plan_data.get('summary', parser.summary or '')
+        plan.safety = plan_data.get('safety', {})
+        plan.total_tokens_estimate = plan.safety.get('estimated_total_tokens', 6000)
+        plan.complete = True
+        
+        if not chunks:
+            raise Exception("Invalid JSON from planner: no chunks in streamed plan")
+        
+        self._report_savings(original_request, plan.total_tokens_estimate, plan.estimated_cost)
+        
+        # Bütçe yüzünden kesilen plan cache'e yazılmaz
+        if not budget_truncated:
+            await self._store_plan(cache_key, DecompositionPlan(
+                summary=plan.summary,
+                chunks=chunks,
+                safety=plan.safety,
+                estimated_cost=plan.estimated_cost,
+                total_tokens_estimate=plan.total_tokens_estimate
+            ))
+    
+    def _normalize_dependencies(self, chunks: List[ChunkPlan]):
+        """Geçersiz bağımlılıkları at; döngü varsa tüm chunk'ları bağımsız çalıştır"""
+        for i, chunk in enumerate(chunks):
+            valid = []
+            for dep in chunk.depends_on:
+                if isinstance(dep, int) and 0 <= dep < len(chunks) and dep != i and dep not in valid:
+                    valid.append(dep)
+            chunk.depends_on = valid
+        
+        # Kahn algoritması ile döngü kontrolü
+        remaining = {i: set(chunk.depends_on) for i, chunk in enumerate(chunks)}
+        while remaining:
+            ready = [i for i, deps in remaining.items() if not deps]
+            if not ready:
+                print("⚠️  Planner bağımlılıklarında döngü var, chunk'lar paralel çalıştırılacak")
+                for chunk in chunks:
+                    chunk.depends_on = []
+                return
+            for i in ready:
+                del remaining[i]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+    
+    def _plan_from_dict(self, plan_data: Dict[str, Any]) -> DecompositionPlan:
+        """Cache'teki dict'ten DecompositionPlan oluştur"""
+        return DecompositionPlan(
+            summary=plan_data['summary'],
+            chunks=[ChunkPlan(**chunk) for chunk in plan_data['chunks']],
+            safety=plan_data['safety'],
+            estimated_cost=plan_data['estimated_cost'],
+            total_tokens_estimate=plan_data['total_tokens_estimate']
+        )
     
     async def execute_chunk(self, chunk: ChunkPlan, chunk_id: int, 
                           original_request: Dict[str, Any], 
-                          quality_header: str = "fast") -> ChunkResult:
-        """Tek chunk'ı execute et"""
+                          quality_header: str = "fast",
+                          dependency_results: Optional[List[ChunkResult]] = None,
+                          context_segments: Optional[List[ContextSegment]] = None,
+                          shared_prefix: Optional[str] = None,
+                          timeout_seconds: Optional[float] = None) -> ChunkResult:
+        """Tek chunk'ı execute et (seçilmiş orijinal context ve önkoşul chunk çıktıları eklenir).
+        shared_prefix verilirse orijinal context prefix'te gelir, prompt'ta sadece chunk'a özel kısım kalır."""
         
         start_time = time.time()
         
-        # Model seçimi (quality header'a göre - config.yaml'dan)
-        if quality_header == "deep":
-            model = self.DEEP_EXECUTION_MODEL  # Config'den: deep_execution_model
-        else:
-            model = self.FAST_EXECUTION_MODEL  # Config'den: fast_execution_model
+        # Model seçimi (quality header'a göre, auto'da chunk zorluğuna göre - config.yaml'dan)
+        model = self._execution_model(quality_header, chunk)
         
         # Chunk-specific prompt
         chunk_prompt = f"""Execute this specific part of a larger coding task:
@@ -348,63 +1553,97 @@ INSTRUCTIONS:
 
 Generate the code changes as unified diff patches."""
 
+        # Orijinal istekten bu chunk için seçilmiş parçalar
+        if context_segments:
+            context_parts = [f"### {seg.name}\n```\n{seg.text}\n```" for seg in context_segments]
+            chunk_prompt += (
+                "\n\nRELEVANT CONTEXT FROM THE ORIGINAL REQUEST:\n\n" + "\n\n".join(context_parts)
+            )
+        
+        # Önkoşul chunk'ların çıktıları (bu chunk'ın girdisi)
+        if dependency_results:
+            prerequisite_parts = [
+                f"### {result.title}\n```diff\n{result.content}\n```"
+                for result in dependency_results
+            ]
+            chunk_prompt += (
+                "\n\nPATCHES ALREADY PRODUCED BY PREREQUISITE CHUNKS "
+                "(build on these, do not repeat them):\n\n" + "\n\n".join(prerequisite_parts)
+            )
+
+        if shared_prefix:
+            chunk_messages = self._prefixed_messages(shared_prefix, chunk_prompt)
+        else:
+            chunk_messages = [{"role": "user", "content": chunk_prompt}]
+        
         # Chunk request (MVP: stream=false, timeout uyumlu)
         chunk_request = {
             "model": model,
-            "messages": [
-                {"role": "user", "content": chunk_prompt}
-            ],
+            "messages": chunk_messages,
             "max_tokens": chunk.max_tokens,
             "temperature": 0.3,
             "stream": False  # MVP: Streaming kapalı
         }
         
+        # Chunk için timeout (config.yaml'dan, çağıran kalan süreyi verebilir)
+        timeout = aiohttp.ClientTimeout(total=timeout_seconds or self.CHUNK_TIMEOUT)
         try:
-            # Chunk için timeout (config.yaml'dan)
-            timeout = aiohttp.ClientTimeout(total=self.CHUNK_TIMEOUT)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    f"{self.litellm_base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.master_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=chunk_request
-                ) as response:
-                    
-                    execution_time = time.time() - start_time
-                    
-                    if response.status != 200:
-                        error_text = await response.text()
-                        return ChunkResult(
-                            chunk_id=chunk_id,
-                            title=chunk.title,
-                            success=False,
-                            content="",
-                            tokens_used=0,
-                            cost=0.0,
-                            execution_time=execution_time,
-                            error_message=f"HTTP {response.status}: {error_text}"
-                        )
-                    
-                    result = await response.json()
-                    content = result['choices'][0]['message']['content']
-                    tokens_used = result.get('usage', {}).get('total_tokens', 0)
-                    
-                    # Maliyet hesapla
-                    cost_per_token = self.model_costs.get(model, 10.0) / 1_000_000
-                    cost = tokens_used * cost_per_token
-                    
+            session = await self._get_session()
+            async with session.post(
+                f"{self.litellm_base_url}/chat/completions",
+                json=chunk_request,
+                timeout=timeout
+            ) as response:
+                
+                execution_time = time.time() - start_time
+                
+                if response.status != 200:
+                    error_text = await response.text()
                     return ChunkResult(
                         chunk_id=chunk_id,
                         title=chunk.title,
-                        success=True,
-                        content=content,
-                        tokens_used=tokens_used,
-                        cost=cost,
-                        execution_time=execution_time
+                        success=False,
+                        content="",
+                        tokens_used=0,
+                        cost=0.0,
+                        execution_time=execution_time,
+                        error_message=f"HTTP {response.status}: {error_text}",
+                        retryable=response.status == 429 or response.status >= 500,
+                        retry_after=self._parse_retry_after(response.headers.get('Retry-After')),
+                        model=model
                     )
-                    
+                
+                result = await response.json()
+                content = result['choices'][0]['message']['content']
+                usage = result.get('usage') or {}
+                tokens_used = usage.get('total_tokens', 0)
+                cache_read, cache_write = self._record_prompt_cache_usage(usage, bool(shared_prefix))
+                
+                # Maliyet hesapla (cache okuma 0.1x, cache yazma 1.25x input fiyatı)
+                cost_per_token = self.model_costs.get(model, 10.0) / 1_000_000
+                billed_tokens = max(tokens_used - 0.9 * cache_read + 0.25 * cache_write, 0)
+                cost = billed_tokens * cost_per_token
+                
+                return ChunkResult(
+                    chunk_id=chunk_id,
+                    title=chunk.title,
+                    success=True,
+                    content=content,
+                    tokens_used=tokens_used,
+                    cost=cost,
+                    execution_time=execution_time,
+                    cache_read_tokens=cache_read,
+                    cache_write_tokens=cache_write,
+                    model=model
+                )
+                
+        except asyncio.TimeoutError:
+            # aiohttp timeout'u (ServerTimeoutError dahil) max_chunk_execution_time'dan önce dolabilir:
+            # genel hata değil, süresi dolmuş (kısmi sonuç) chunk olarak dön
+            result = self._timed_out_result(chunk, chunk_id, time.time() - start_time,
+                                            f"chunk exceeded {timeout.total:.0f}s")
+            result.model = model
+            return result
         except Exception as e:
             return ChunkResult(
                 chunk_id=chunk_id,
@@ -414,21 +1653,100 @@ Generate the code changes as unified diff patches."""
                 tokens_used=0,
                 cost=0.0,
                 execution_time=time.time() - start_time,
-                error_message=str(e)
+                error_message=str(e),
+                model=model
             )
     
+    def _execution_model(self, quality_header: str, chunk: Optional[ChunkPlan] = None) -> str:
+        """Chunk execution modeli (quality header'a göre - config.yaml'dan).
+        auto: zorluk skoru deep_complexity_threshold ve üstü olan chunk'lar deep modele gider."""
+        if quality_header == "deep":
+            return self.DEEP_EXECUTION_MODEL  # Config'den: deep_execution_model
+        if quality_header == "auto" and chunk is not None:
+            if self._chunk_complexity(chunk) >= self.DEEP_COMPLEXITY_THRESHOLD:
+                return self.DEEP_EXECUTION_MODEL
+        return self.FAST_EXECUTION_MODEL  # Config'den: fast_execution_model
+    
+    def _chunk_complexity(self, chunk: ChunkPlan) -> int:
+        """Chunk zorluğu (1-5): planner skoru, yoksa goal uzunluğu, dosya sayısı ve beklenen çıktıdan tahmin"""
+        if chunk.complexity is not None:
+            return chunk.complexity
+        
+        score = 1
+        if len(chunk.goal.split()) > 25:  # Uzun, çok adımlı hedef
+            score += 1
+        if len(chunk.inputs_needed) >= 3:  # Birden fazla dosyaya dokunan değişiklik
+            score += 1
+        if len(chunk.expected_output.split()) > 20:  # Ayrıntılı/büyük çıktı bekleniyor
+            score += 1
+        if chunk.depends_on:  # Önceki chunk'ların çıktısı üzerine kuruluyor
+            score += 1
+        return score
+    
+    def _parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Retry-After header'ı (saniye veya HTTP tarihi) -> saniye"""
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+    
+    def _retry_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff; upstream Retry-After verdiyse en az o kadar bekle"""
+        backoff = random.uniform(0, min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * (2 ** attempt)))
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+    
+    def _effective_max_cost(self, max_cost: Optional[float]) -> float:
+        """Header'dan gelen max_cost veya config'den, safety margin uygulanmış"""
+        effective_max_cost = max_cost if max_cost else self.MAX_COST_PER_REQUEST
+        return effective_max_cost * (1 - self.COST_SAFETY_MARGIN)
+    
     def check_budget_limits(self, estimated_cost: float, max_cost: Optional[float]) -> Tuple[bool, str]:
         """Bütçe limitlerini kontrol et (config.yaml'dan max_cost_per_request)"""
-        # Header'dan gelen max_cost veya config'den
-        effective_max_cost = max_cost if max_cost else self.MAX_COST_PER_REQUEST
-        
-        # Safety margin uygula
-        effective_max_cost = effective_max_cost * (1 - self.COST_SAFETY_MARGIN)
+        effective_max_cost = self._effective_max_cost(max_cost)
         
         if estimated_cost > effective_max_cost:
             return False, f"Estimated cost ${estimated_cost:.4f} exceeds limit ${effective_max_cost:.4f} (with {self.COST_SAFETY_MARGIN*100:.0f}% safety margin)"
         return True, ""
     
+    def _format_chunk_result(self, result: ChunkResult) -> List[str]:
+        """Tek chunk sonucunu markdown satırlarına dönüştür"""
+        parts = [
+            f"## CHUNK {result.chunk_id + 1}: {result.title}",
+            f"**Status:** {'✅ Success' if result.success else ('⏱️ Timed out' if result.timed_out else '❌ Failed')}",
+            f"**Tokens:** {result.tokens_used:,}",
+            f"**Cost:** ${result.cost:.4f}",
+            f"**Time:** {result.execution_time:.2f}s",
+            ""
+        ]
+        if result.attempts > 1:
+            parts.insert(-1, f"**Attempts:** {result.attempts}")
+        
+        if result.success:
+            parts.extend([
+                "**Generated Patches:**",
+                "```diff",
+                result.content,
+                "```",
+                ""
+            ])
+        else:
+            parts.extend([
+                f"**Error:** {result.error_message}",
+                ""
+            ])
+        
+        parts.append("---\n")
+        return parts
+    
     def combine_results(self, plan: DecompositionPlan, 
                        chunk_results: List[ChunkResult]) -> Dict[str, Any]:
         """Chunk sonuçlarını birleştir"""
@@ -437,6 +1755,7 @@ Generate the code changes as unified diff patches."""
         total_tokens = sum(r.tokens_used for r in chunk_results)
         total_cost = sum(r.cost for r in chunk_results)
         successful_chunks = [r for r in chunk_results if r.success]
+        timed_out_chunks = [r for r in chunk_results if r.timed_out]
         
         # Response content oluştur
         content_parts = [
@@ -450,33 +1769,13 @@ Generate the code changes as unified diff patches."""
             "---",
             ""
         ]
+        if timed_out_chunks:
+            # Deadline'a yetişmeyen chunk'lar: kısmi sonuç
+            content_parts[6:6] = [f"**Timed Out:** {len(timed_out_chunks)} chunk(s) - partial result"]
         
         # Her chunk için sonuçlar
         for result in chunk_results:
-            content_parts.extend([
-                f"## CHUNK {result.chunk_id + 1}: {result.title}",
-                f"**Status:** {'✅ Success' if result.success else '❌ Failed'}",
-                f"**Tokens:** {result.tokens_used:,}",
-                f"**Cost:** ${result.cost:.4f}",
-                f"**Time:** {result.execution_time:.2f}s",
-                ""
-            ])
-            
-            if result.success:
-                content_parts.extend([
-                    "**Generated Patches:**",
-                    "```diff",
-                    result.content,
-                    "```",
-                    ""
-                ])
-            else:
-                content_parts.extend([
-                    f"**Error:** {result.error_message}",
-                    ""
-                ])
-            
-            content_parts.append("---\n")
+            content_parts.extend(self._format_chunk_result(result))
         
         # OpenAI-style response
         return {
@@ -501,67 +1800,101 @@ Generate the code changes as unified diff patches."""
                 "decomposed": True,
                 "chunks_executed": len(chunk_results),
                 "chunks_successful": len(successful_chunks),
+                "chunks_timed_out": len(timed_out_chunks),
+                "partial": bool(timed_out_chunks),
                 "total_cost": total_cost,
-                "execution_time": sum(r.execution_time for r in chunk_results)
+                "execution_time": sum(r.execution_time for r in chunk_results),
+                "cache_read_tokens": sum(r.cache_read_tokens for r in chunk_results),
+                "cache_write_tokens": sum(r.cache_write_tokens for r in chunk_results),
+                "chunks": [
+                    {
+                        "chunk_id": r.chunk_id,
+                        "model": r.model,
+                        "success": r.success,
+                        "tokens_used": r.tokens_used,
+                        "cost": r.cost,
+                        "execution_time": r.execution_time
+                    } for r in chunk_results
+                ]
             }
         }
     
+    def _budget_error(self, error: BudgetExceededError) -> Dict[str, Any]:
+        """Bütçe aşımı hata gövdesi"""
+        return {
+            "message": f"Budget exceeded. {error}. Please narrow the scope.",
+            "type": "budget_exceeded",
+            "estimated_cost": error.estimated_cost,
+            "plan_summary": error.plan_summary
+        }
+    
+    async def _start_plan(self, request_data: Dict[str, Any], headers: Dict[str, str],
+                          shared_prefix: Optional[str],
+                          deadline: Optional[float]) -> Tuple[DecompositionPlan, Optional[AsyncIterator[ChunkPlan]]]:
+        """Planı başlat. Streaming planner'da plan boş döner ve chunk'lar feed üzerinden gelir
+        (bütçe kontrolü chunk geldikçe yapılır); aksi halde tam plan bütçe kontrolünden geçer."""
+        if self.PLANNER_STREAMING:
+            print("🧠 Streaming decomposition plan...")
+            plan = DecompositionPlan(summary="", chunks=[], safety={}, estimated_cost=0.0,
+                                     total_tokens_estimate=0, complete=False)
+            return plan, self.create_plan_stream(request_data, headers, plan, shared_prefix, deadline)
+        
+        # Plan oluştur (headers ile birlikte)
+        print("🧠 Creating decomposition plan...")
+        plan = await self.create_plan(request_data, headers, shared_prefix, deadline)
+        
+        # Bütçe kontrolü
+        max_cost = request_data.get('max_cost')
+        budget_ok, budget_msg = self.check_budget_limits(plan.estimated_cost, max_cost)
+        if not budget_ok:
+            raise BudgetExceededError(budget_msg, plan.estimated_cost, plan.summary)
+        
+        print(f"⚡ Executing {len(plan.chunks)} chunks...")
+        return plan, None
+    
     async def process_request(self, request_data: Dict[str, Any], 
                             headers: Dict[str, str]) -> Dict[str, Any]:
         """Ana request processing fonksiyonu"""
         
+        # Planner + tüm chunk'lar için ortak deadline (config.yaml: total_timeout)
+        deadline = time.monotonic() + self.TOTAL_TIMEOUT
+        
         try:
-            # 1. Plan oluştur (headers ile birlikte)
-            print("🧠 Creating decomposition plan...")
-            plan = await self.create_plan(request_data, headers)
-            
-            # 2. Bütçe kontrolü
-            max_cost = request_data.get('max_cost')
-            budget_ok, budget_msg = self.check_budget_limits(plan.estimated_cost, max_cost)
+            # Orijinal isteği indeksle (chunk context seçimi ve ortak prefix için)
+            context_index = await self.build_context_index(request_data)
+            shared_prefix = None
+            if self._prompt_cache_prefix_enabled(headers):
+                shared_prefix = self.build_shared_prefix(request_data, context_index)
             
-            if not budget_ok:
-                return {
-                    "error": {
-                        "message": f"Budget exceeded. {budget_msg}. Please narrow the scope.",
-                        "type": "budget_exceeded",
-                        "estimated_cost": plan.estimated_cost,
-                        "plan_summary": plan.summary
-                    }
-                }
+            # 1-2. Plan oluştur ve bütçeyi kontrol et (streaming'de chunk'lar plan yazılırken başlar)
+            plan, chunk_feed = await self._start_plan(request_data, headers, shared_prefix, deadline)
             
             # 3. Chunk'ları execute et
-            print(f"⚡ Executing {len(plan.chunks)} chunks...")
             quality = headers.get('x-quality', 'fast')
             
-            chunk_tasks = []
-            for i, chunk in enumerate(plan.chunks):
-                task = self.execute_chunk(chunk, i, request_data, quality)
-                chunk_tasks.append(task)
-            
-            # Paralel execution
-            chunk_results = await asyncio.gather(*chunk_tasks, return_exceptions=True)
-            
-            # Exception handling
-            valid_results = []
-            for i, result in enumerate(chunk_results):
-                if isinstance(result, Exception):
-                    valid_results.append(ChunkResult(
-                        chunk_id=i,
-                        title=plan.chunks[i].title,
-                        success=False,
-                        content="",
-                        tokens_used=0,
-                        cost=0.0,
-                        execution_time=0.0,
-                        error_message=str(result)
-                    ))
-                else:
-                    valid_results.append(result)
+            # Bağımlılık sırasına göre (bağımsızlar paralel) execution
+            valid_results = [
+                result async for result in self._iter_chunk_results(
+                    plan, request_data, quality, context_index, shared_prefix, deadline, chunk_feed
+                )
+            ]
+            valid_results.sort(key=lambda r: r.chunk_id)
             
             # 4. Sonuçları birleştir
             print("🔄 Combining results...")
             return self.combine_results(plan, valid_results)
             
+        except BudgetExceededError as e:
+            return {"error": self._budget_error(e)}
+        except asyncio.CancelledError as e:
+            # Client koptu veya yarışı direkt çağrı kazandı: planner/chunk çağrıları iptal edildi
+            if e.args and e.args[0] == self.RACE_LOSER_CANCEL:
+                self.cancellation_stats["race_losers"] += 1
+                print("🏁 Decomposition cancelled (race lost)")
+            else:
+                self.cancellation_stats["requests_cancelled"] += 1
+                print("🔌 Decomposition cancelled")
+            raise
         except Exception as e:
             return {
                 "error": {
@@ -570,6 +1903,449 @@ Generate the code changes as unified diff patches."""
                 }
             }
 
+    async def _execute_chunk_safe(self, chunk: ChunkPlan, chunk_id: int,
+                                  original_request: Dict[str, Any],
+                                  quality_header: str = "fast",
+                                  dependency_results: Optional[List[ChunkResult]] = None,
+                                  context_segments: Optional[List[ContextSegment]] = None,
+                                  shared_prefix: Optional[str] = None,
+                                  deadline: Optional[float] = None) -> ChunkResult:
+        """execute_chunk'ı max_chunk_execution_time (ve toplam deadline) ile sınırlı çalıştır,
+        beklenmeyen exception'ı başarısız ChunkResult'a çevir"""
+        start_time = time.time()
+        chunk_budget = self.MAX_CHUNK_EXECUTION_TIME
+        remaining = self._remaining(deadline)
+        if remaining is not None:
+            chunk_budget = min(chunk_budget, remaining)
+        
+        try:
+            return await asyncio.wait_for(
+                self.execute_chunk(chunk, chunk_id, original_request, quality_header,
+                                   dependency_results, context_segments, shared_prefix,
+                                   timeout_seconds=min(self.CHUNK_TIMEOUT, chunk_budget)),
+                timeout=chunk_budget
+            )
+        except asyncio.TimeoutError:
+            return self._timed_out_result(chunk, chunk_id, time.time() - start_time,
+                                          f"chunk exceeded {chunk_budget:.0f}s")
+        except Exception as e:
+            return ChunkResult(
+                chunk_id=chunk_id,
+                title=chunk.title,
+                success=False,
+                content="",
+                tokens_used=0,
+                cost=0.0,
+                execution_time=0.0,
+                error_message=str(e)
+            )
+    
+    async def _execute_chunk_with_retry(self, chunk: ChunkPlan, chunk_id: int,
+                                        original_request: Dict[str, Any],
+                                        quality_header: str = "fast",
+                                        dependency_results: Optional[List[ChunkResult]] = None,
+                                        context_segments: Optional[List[ContextSegment]] = None,
+                                        shared_prefix: Optional[str] = None,
+                                        deadline: Optional[float] = None,
+                                        retry_budget: Optional[RetryBudget] = None) -> ChunkResult:
+        """Geçici hata (HTTP 429/5xx) alan chunk'ı backoff ile tekrar dene.
+        Retry'lar istek başına max_internal_calls ve kalan maliyet bütçesiyle sınırlı."""
+        start_time = time.time()
+        attempt = 0
+        
+        while True:
+            result = await self._execute_chunk_safe(chunk, chunk_id, original_request, quality_header,
+                                                    dependency_results, context_segments,
+                                                    shared_prefix, deadline)
+            result.attempts = attempt + 1
+            if result.success:
+                if attempt:
+                    self.retry_stats["recovered"] += 1
+                break
+            if not result.retryable or retry_budget is None:
+                break
+            if attempt >= self.CHUNK_MAX_RETRIES:
+                self.retry_stats["exhausted"] += 1
+                break
+            
+            delay = self._retry_delay(attempt, result.retry_after)
+            remaining = self._remaining(deadline)
+            if remaining is not None and delay >= remaining:
+                self.retry_stats["denied_by_deadline"] += 1
+                break
+            
+            retry_cost = self._chunk_cost_estimate(chunk, quality_header)
+            reserved, reason = retry_budget.reserve(retry_cost)
+            if not reserved:
+                if retry_budget.calls_remaining <= 0:
+                    self.retry_stats["denied_by_call_limit"] += 1
+                else:
+                    self.retry_stats["denied_by_cost_limit"] += 1
+                print(f"⚠️  Chunk {chunk_id + 1} not retried: {reason}")
+                break
+            
+            self.retry_stats["retries"] += 1
+            print(f"🔁 Chunk {chunk_id + 1} retry {attempt + 1} in {delay:.1f}s ({result.error_message[:80]})")
+            await asyncio.sleep(delay)
+            attempt += 1
+        
+        if attempt:
+            result.execution_time = time.time() - start_time
+        return result
+    
+    async def _iter_chunk_results(self, plan: DecompositionPlan,
+                                  request_data: Dict[str, Any],
+                                  quality: str,
+                                  context_index: Optional[ContextIndex] = None,
+                                  shared_prefix: Optional[str] = None,
+                                  deadline: Optional[float] = None,
+                                  chunk_feed: Optional[AsyncIterator[ChunkPlan]] = None,
+                                  emit_plan: bool = False) -> AsyncIterator[Union[ChunkResult, DecompositionPlan]]:
+        """Chunk DAG'ini çalıştır: bağımsız chunk'lar paralel, bağımlılar önkoşulları biter bitmez başlar.
+        chunk_feed verilirse (streaming planner) chunk'lar plan.chunks'a geldikçe eklenir.
+        emit_plan verilirse planner bittiği anda (plan.complete, feed tükendi) plan nesnesi bir kez ayrıca döner.
+        Sonuçlar tamamlanma sırasına göre döner. Deadline dolunca kalan chunk'lar timed out olarak döner."""
+        
+        chunks = plan.chunks
+        results: Dict[int, ChunkResult] = {}
+        running: Dict[asyncio.Task, int] = {}
+        started_at: Dict[int, float] = {}
+        pending = set(range(len(chunks)))
+        
+        # Retry hakkı: planner + ilk denemelerden sonra kalan internal call'lar ve maliyet bütçesi.
+        # Plan hâlâ stream ediliyorsa gelebilecek MAX_CHUNKS ilk deneme için yer ayrılır.
+        planned_chunks = self.MAX_CHUNKS if chunk_feed is not None else len(chunks)
+        retry_budget = RetryBudget(
+            calls_remaining=self.MAX_INTERNAL_CALLS - 1 - planned_chunks,
+            cost_remaining=self._effective_max_cost(request_data.get('max_cost')) - plan.estimated_cost
+        )
+        estimate_seen = plan.estimated_cost
+        
+        feed_task: Optional[asyncio.Task] = None
+        if chunk_feed is not None:
+            feed_task = asyncio.ensure_future(chunk_feed.__anext__())
+        
+        try:
+            while pending or running or feed_task is not None:
+                # Önkoşulları tamamlanan chunk'ları başlat
+                started = True
+                while started:
+                    started = False
+                    for i in sorted(pending):
+                        deps = chunks[i].depends_on
+                        if not all(dep in results for dep in deps):
+                            continue
+                        
+                        pending.discard(i)
+                        started = True
+                        if self._remaining(deadline) == 0:
+                            result = self._timed_out_result(chunks[i], i, 0.0,
+                                                            f"total_timeout ({self.TOTAL_TIMEOUT}s) reached before start")
+                            results[i] = result
+                            yield result
+                            continue
+                        
+                        failed_deps = [dep for dep in deps if not results[dep].success]
+                        if failed_deps:
+                            # Önkoşulu başarısız chunk'ı çalıştırmak boşa maliyet olur
+                            result = ChunkResult(
+                                chunk_id=i,
+                                title=chunks[i].title,
+                                success=False,
+                                content="",
+                                tokens_used=0,
+                                cost=0.0,
+                                execution_time=0.0,
+                                error_message=f"Skipped: prerequisite chunk(s) {[dep + 1 for dep in failed_deps]} failed"
+                            )
+                            results[i] = result
+                            yield result
+                            continue
+                        
+                        # Ortak prefix modunda orijinal context zaten prefix'te
+                        context_segments = None
+                        if context_index is not None and not shared_prefix:
+                            context_segments = context_index.select(
+                                f"{chunks[i].title} {chunks[i].goal}",
+                                chunks[i].inputs_needed,
+                                self.CHUNK_CONTEXT_TOKEN_BUDGET
+                            )
+                        
+                        if quality == "auto":
+                            # Routing metrikleri chunk başına bir kez (retry denemeleri sayılmaz)
+                            model = self._execution_model(quality, chunks[i])
+                            self.routing_stats["deep_chunks" if model == self.DEEP_EXECUTION_MODEL else "fast_chunks"] += 1
+                            self.routing_stats["planner_scored" if chunks[i].complexity is not None else "heuristic_scored"] += 1
+                        
+                        task = asyncio.ensure_future(self._execute_chunk_with_retry(
+                            chunks[i], i, request_data, quality,
+                            [results[dep] for dep in deps], context_segments, shared_prefix, deadline,
+                            retry_budget
+                        ))
+                        running[task] = i
+                        started_at[i] = time.time()
+                
+                waitables = set(running)
+                if feed_task is not None:
+                    waitables.add(feed_task)
+                if not waitables:
+                    break
+                
+                done, _ = await asyncio.wait(waitables, timeout=self._remaining(deadline),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Toplam deadline doldu: yetişmeyenleri iptal et, kısmi sonuç için timed out döndür
+                    print(f"⏱️ Total timeout ({self.TOTAL_TIMEOUT}s) reached, "
+                          f"{len(running) + len(pending)} chunk(s) timed out")
+                    if feed_task is not None:
+                        # Planner hâlâ yazıyor: gelmemiş chunk'lar plana girmez
+                        feed_task.cancel()
+                        await asyncio.gather(feed_task, return_exceptions=True)
+                        feed_task = None
+                        plan.complete = True
+                    for task in running:
+                        task.cancel()
+                    await asyncio.gather(*running, return_exceptions=True)
+                    if emit_plan:
+                        yield plan
+                    
+                    now = time.time()
+                    timed_out = sorted(running.values())
+                    running.clear()
+                    for i in timed_out:
+                        yield self._timed_out_result(chunks[i], i, now - started_at[i],
+                                                     f"total_timeout ({self.TOTAL_TIMEOUT}s) reached")
+                    for i in sorted(pending):
+                        yield self._timed_out_result(chunks[i], i, 0.0,
+                                                     f"total_timeout ({self.TOTAL_TIMEOUT}s) reached before start")
+                    pending.clear()
+                    break
+                
+                if feed_task is not None and feed_task in done:
+                    done.discard(feed_task)
+                    try:
+                        chunk = feed_task.result()
+                    except StopAsyncIteration:
+                        # Planner bitti: ayrılan ama kullanılmayan ilk deneme hakları retry'a kalır
+                        feed_task = None
+                        retry_budget.calls_remaining += self.MAX_CHUNKS - len(chunks)
+                    except Exception as e:
+                        feed_task = None
+                        if not chunks:
+                            raise
+                        print(f"⚠️  Planner stream failed after {len(chunks)} chunk(s), continuing with them: {e}")
+                        plan.complete = True
+                    else:
+                        chunks.append(chunk)
+                        pending.add(len(chunks) - 1)
+                        retry_budget.cost_remaining -= plan.estimated_cost - estimate_seen
+                        estimate_seen = plan.estimated_cost
+                        print(f"⚡ Chunk {len(chunks)} planned: {chunk.title}")
+                        feed_task = asyncio.ensure_future(chunk_feed.__anext__())
+                
+                if emit_plan and feed_task is None and plan.complete:
+                    # Plan tamamlandı: ilk chunk sonucunu beklemeden bildir
+                    emit_plan = False
+                    yield plan
+                
+                for task in done:
+                    i = running.pop(task)
+                    results[i] = task.result()
+                    yield results[i]
+        finally:
+            # Erken kapatılırsa (client koptu vb.) planner stream'ini ve çalışan chunk'ları iptal et
+            if feed_task is not None and not feed_task.done():
+                feed_task.cancel()
+                await asyncio.gather(feed_task, return_exceptions=True)
+            if chunk_feed is not None:
+                await chunk_feed.aclose()
+            for task in running:
+                if not task.done():
+                    task.cancel()
+                    self.cancellation_stats["chunks_cancelled"] += 1
+    
+    def _stream_event(self, stream_id: str, content: str, event: Dict[str, Any],
+                      finish_reason: Optional[str] = None) -> Dict[str, Any]:
+        """OpenAI chat.completion.chunk formatında streaming event'i oluştur"""
+        return {
+            "id": stream_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "haiku-planner",
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": content} if content else {},
+                "finish_reason": finish_reason
+            }],
+            "haiku_planner": event
+        }
+    
+    def _plan_event(self, stream_id: str, plan: DecompositionPlan) -> Dict[str, Any]:
+        """Plan başlığı streaming event'i"""
+        plan_header = "\n".join([
+            "# DECOMPOSITION PLAN",
+            f"**Summary:** {plan.summary}",
+            f"**Chunks:** {len(plan.chunks)}",
+            "",
+            "---",
+            ""
+        ]) + "\n"
+        return self._stream_event(stream_id, plan_header, {
+            "event": "plan",
+            "summary": plan.summary,
+            "chunks": [chunk.title for chunk in plan.chunks],
+            "estimated_cost": plan.estimated_cost
+        })
+    
+    def _chunk_event(self, stream_id: str, result: ChunkResult) -> Dict[str, Any]:
+        """Tamamlanan chunk streaming event'i"""
+        return self._stream_event(
+            stream_id,
+            "\n".join(self._format_chunk_result(result)) + "\n",
+            {
+                "event": "chunk",
+                "chunk_id": result.chunk_id,
+                "title": result.title,
+                "success": result.success,
+                "tokens_used": result.tokens_used,
+                "cost": result.cost,
+                "execution_time": result.execution_time,
+                "error_message": result.error_message,
+                "timed_out": result.timed_out,
+                "attempts": result.attempts,
+                "model": result.model,
+                "cache_read_tokens": result.cache_read_tokens,
+                "cache_write_tokens": result.cache_write_tokens
+            }
+        )
+    
+    async def process_request_stream(self, request_data: Dict[str, Any],
+                                     headers: Dict[str, str]) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming request processing: plan, tamamlanan her chunk ve kullanım özeti ayrı event olarak döner"""
+        
+        stream_id = f"chatcmpl-haiku-{int(time.time())}"
+        start_time = time.time()
+        deadline = time.monotonic() + self.TOTAL_TIMEOUT
+        
+        try:
+            context_index = await self.build_context_index(request_data)
+            shared_prefix = None
+            if self._prompt_cache_prefix_enabled(headers):
+                shared_prefix = self.build_shared_prefix(request_data, context_index)
+            
+            # 1-2. Plan oluştur ve bütçeyi kontrol et (streaming planner'da chunk'lar plan yazılırken başlar)
+            plan, chunk_feed = await self._start_plan(request_data, headers, shared_prefix, deadline)
+        except BudgetExceededError as e:
+            yield self._stream_event(stream_id, "", {
+                "event": "error",
+                "error": self._budget_error(e)
+            }, finish_reason="error")
+            return
+        except Exception as e:
+            yield self._stream_event(stream_id, "", {
+                "event": "error",
+                "error": {"message": f"Haiku Planner error: {str(e)}", "type": "planner_error"}
+            }, finish_reason="error")
+            return
+        
+        # 3. Chunk'ları bağımlılık sırasına göre başlat, tamamlanma sırasına göre gönder
+        quality = headers.get('x-quality', 'fast')
+        
+        # Plan event'i her zaman ilk gider: plan hazırsa hemen, streaming planner'da planner biter bitmez
+        plan_sent = False
+        if plan.complete:
+            yield self._plan_event(stream_id, plan)
+            plan_sent = True
+        
+        chunk_results = self._iter_chunk_results(plan, request_data, quality, context_index,
+                                                 shared_prefix, deadline, chunk_feed,
+                                                 emit_plan=not plan_sent)
+        
+        total_tokens = 0
+        total_cost = 0.0
+        successful = 0
+        timed_out = 0
+        cache_read_tokens = 0
+        cache_write_tokens = 0
+        
+        # Planner hâlâ yazarken biten chunk'lar plan event'ine kadar bekletilir
+        held_results: List[ChunkResult] = []
+        
+        try:
+            async for result in chunk_results:
+                if result is plan:
+                    yield self._plan_event(stream_id, plan)
+                    plan_sent = True
+                    for held in held_results:
+                        yield self._chunk_event(stream_id, held)
+                    held_results = []
+                    continue
+                
+                total_tokens += result.tokens_used
+                total_cost += result.cost
+                successful += 1 if result.success else 0
+                timed_out += 1 if result.timed_out else 0
+                cache_read_tokens += result.cache_read_tokens
+                cache_write_tokens += result.cache_write_tokens
+                
+                if plan_sent:
+                    yield self._chunk_event(stream_id, result)
+                else:
+                    held_results.append(result)
+        except BudgetExceededError as e:
+            yield self._stream_event(stream_id, "", {
+                "event": "error",
+                "error": self._budget_error(e)
+            }, finish_reason="error")
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancellation_stats["requests_cancelled"] += 1
+            print("🔌 Decomposition stream cancelled")
+            raise
+        except Exception as e:
+            # Streaming planner hiç chunk üretemeden başarısız oldu
+            yield self._stream_event(stream_id, "", {
+                "event": "error",
+                "error": {"message": f"Haiku Planner error: {str(e)}", "type": "planner_error"}
+            }, finish_reason="error")
+            return
+        finally:
+            # Client bağlantıyı kapatırsa bekleyen chunk'ları iptal et
+            await chunk_results.aclose()
+        
+        if not plan_sent:
+            yield self._plan_event(stream_id, plan)
+        for held in held_results:
+            yield self._chunk_event(stream_id, held)
+        
+        # 4. Kullanım / maliyet özeti
+        trailer_lines = [
+            f"**Success Rate:** {successful}/{len(plan.chunks)}",
+            f"**Total Cost:** ${total_cost:.4f}",
+            f"**Total Tokens:** {total_tokens:,}"
+        ]
+        if timed_out:
+            trailer_lines.insert(1, f"**Timed Out:** {timed_out} chunk(s) - partial result")
+        trailer = "\n".join(trailer_lines)
+        final_event = self._stream_event(stream_id, trailer, {
+            "event": "done",
+            "decomposed": True,
+            "chunks_executed": len(plan.chunks),
+            "chunks_successful": successful,
+            "chunks_timed_out": timed_out,
+            "partial": timed_out > 0,
+            "total_cost": total_cost,
+            "execution_time": time.time() - start_time,
+            "cache_read_tokens": cache_read_tokens,
+            "cache_write_tokens": cache_write_tokens
+        }, finish_reason="stop")
+        final_event["usage"] = {
+            "prompt_tokens": plan.total_tokens_estimate,
+            "completion_tokens": total_tokens,
+            "total_tokens": plan.total_tokens_estimate + total_tokens
+        }
+        yield final_event
+
 # Test fonksiyonu
 async def test_haiku_planner():
     """Test fonksiyonu"""
@@ -612,7 +2388,10 @@ Please implement all components with proper error handling, validation, security
     headers = {"x-decompose": "1", "x-quality": "fast"}
     
     print("🧪 Testing Haiku Planner...")
-    result = await planner.process_request(test_request, headers)
+    try:
+        result = await planner.process_request(test_request, headers)
+    finally:
+        await planner.close()
     
     if "error" in result:
         print(f"❌ Error: {result['error']['message']}")
@@ -5,12 +5,18 @@ FastAPI middleware for Large Request Decomposition
 """
 
 from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import httpx
 import asyncio
 import json
 import os
-from typing import Optional, Dict, Any
+import time
+import hashlib
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+from datetime import datetime
 import logging
 import sys
 import os
@@ -34,6 +40,22 @@ except ImportError:
     else:
         raise ImportError(f"haiku-planner-middleware.py not found at {middleware_path}")
 
+# Kullanım kaydı (opsiyonel: monitoring-dashboard.py yoksa kayıt tutulmaz)
+try:
+    from monitoring_dashboard import UsageMonitor, UsageRecord
+except ImportError:
+    import importlib.util
+    monitor_path = os.path.join(os.path.dirname(__file__), "monitoring-dashboard.py")
+    if os.path.exists(monitor_path):
+        spec = importlib.util.spec_from_file_location("monitoring_dashboard", monitor_path)
+        monitor_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(monitor_module)
+        UsageMonitor = monitor_module.UsageMonitor
+        UsageRecord = monitor_module.UsageRecord
+    else:
+        UsageMonitor = None
+        UsageRecord = None
+
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,10 +66,366 @@ app = FastAPI(title="LiteLLM Proxy with Haiku Planner")
 # Haiku Planner instance
 haiku_planner = None
 
+# Upstream (LiteLLM) için worker başına tek, uzun ömürlü HTTP client
+http_client: Optional[httpx.AsyncClient] = None
+
+# Kullanım kaydı ayarları (environment variable'lardan); kayıtlar arka planda batch halinde yazılır
+USAGE_TRACKING_ENABLED = os.getenv("USAGE_TRACKING_ENABLED", "1") == "1"
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage_monitor.db")
+USAGE_QUEUE_SIZE = int(os.getenv("USAGE_QUEUE_SIZE", 10000))
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", 500))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 1.0))
+
+usage_monitor = None
+
+# Connection pool ayarları (environment variable'lardan)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 60.0))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "0") == "1"
+
+@dataclass
+class UpstreamPoolStats:
+    """Upstream connection pool metrikleri"""
+    requests_total: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    saturated_requests: int = 0  # Pool dolu iken başlayan istekler
+    pool_timeouts: int = 0
+    errors: int = 0
+
+upstream_stats = UpstreamPoolStats()
+
+@dataclass
+class StreamingStats:
+    """SSE streaming pass-through metrikleri"""
+    streams_started: int = 0
+    streams_completed: int = 0
+    streams_failed: int = 0  # Stream açılmadan upstream hatası
+    streams_interrupted: int = 0  # Stream ortasında kopan bağlantı
+    bytes_relayed: int = 0
+    total_ttfb: float = 0.0  # Time-to-first-byte toplamı (saniye)
+    total_duration: float = 0.0  # Stream süresi toplamı (saniye)
+    last_ttfb: float = 0.0
+    last_duration: float = 0.0
+
+streaming_stats = StreamingStats()
+
+# Client bağlantısı koptuğunda upstream işini iptal etme ayarları
+CLIENT_DISCONNECT_POLL_INTERVAL = float(os.getenv("CLIENT_DISCONNECT_POLL_INTERVAL", 0.5))
+
+@dataclass
+class DisconnectStats:
+    """Client kopması nedeniyle iptal edilen iş metrikleri"""
+    disconnects: int = 0
+    cancelled_forwards: int = 0  # Upstream'i beklerken iptal edilen pass-through istekler
+    cancelled_decompositions: int = 0  # Planner/chunk'ları iptal edilen decomposition istekleri
+    cancelled_streams: int = 0  # Client kapattığı için yarıda kesilen SSE stream'ler
+
+disconnect_stats = DisconnectStats()
+
+class ClientDisconnected(Exception):
+    """Client cevap beklemeden bağlantıyı kapattı"""
+
+# Race modu: decomposition ile paralel direkt çağrı (x-race: 1 header'ı ile istek bazında açılır)
+RACE_MODE_ENABLED = os.getenv("RACE_MODE_ENABLED", "1") == "1"
+RACE_MAX_DIRECT_COST = float(os.getenv("RACE_MAX_DIRECT_COST", 0.5))  # Spekülatif direkt çağrı için USD tavanı
+RACE_OUTCOME_HISTORY = int(os.getenv("RACE_OUTCOME_HISTORY", 200))
+
+@dataclass
+class RaceStats:
+    """Direkt çağrı / decomposition yarışı metrikleri"""
+    races: int = 0
+    direct_wins: int = 0
+    decomposition_wins: int = 0
+    both_failed: int = 0
+    skipped_cost_ceiling: int = 0  # Direkt çağrı tahmini RACE_MAX_DIRECT_COST'u aştı
+    losers_cancelled: int = 0
+
+race_stats = RaceStats()
+race_outcomes: deque = deque(maxlen=RACE_OUTCOME_HISTORY)  # should_decompose_async eşiklerini yeniden ayarlamak için
+
+# Proxy içi exact-match response cache ayarları
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+
+def _normalize_text(text: str) -> str:
+    """Satır sonu ve satır sonundaki boşluk farklarını yok say"""
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+def _normalize_messages(messages: Any) -> Any:
+    """Mesaj içeriklerini whitespace açısından normalize et"""
+    if not isinstance(messages, list):
+        return messages
+    
+    normalized = []
+    for message in messages:
+        if not isinstance(message, dict):
+            normalized.append(message)
+            continue
+        message = dict(message)
+        content = message.get("content")
+        if isinstance(content, str):
+            message["content"] = _normalize_text(content)
+        elif isinstance(content, list):
+            message["content"] = [
+                {**item, "text": _normalize_text(item.get("text", ""))}
+                if isinstance(item, dict) and item.get("type") == "text" else item
+                for item in content
+            ]
+        normalized.append(message)
+    return normalized
+
+def canonical_request_hash(path: str, body: Dict[str, Any], authorization: str = "") -> str:
+    """Endpoint + kanonik body (sıralı key'ler, normalize mesajlar) + API key hash'i"""
+    canonical_body = dict(body)
+    if "messages" in canonical_body:
+        canonical_body["messages"] = _normalize_messages(canonical_body["messages"])
+    if isinstance(canonical_body.get("prompt"), str):
+        canonical_body["prompt"] = _normalize_text(canonical_body["prompt"])
+    
+    payload = json.dumps(
+        {"path": path, "body": canonical_body, "auth": authorization},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Byte bütçeli, TTL + LRU exact-match response cache"""
+    
+    def __init__(self, ttl: int, max_bytes: int, max_entry_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created_at, body_bytes)
+        self.current_bytes = 0
+        
+        # Sayaçlar
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.sampled = 0  # temperature > 0 (veya yok) olduğu için cache'e girmeyen istekler
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.oversized = 0
+    
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        created_at, content = entry
+        if time.time() - created_at > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content
+    
+    def set(self, key: str, content: bytes):
+        if len(content) > self.max_entry_bytes:
+            self.oversized += 1
+            return
+        
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time(), content)
+        self.current_bytes += len(content)
+        self.stores += 1
+        
+        # Byte bütçesini aşınca en eski kayıtları at
+        while self.current_bytes > self.max_bytes and self._entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+    
+    def _remove(self, key: str):
+        _, content = self._entries.pop(key)
+        self.current_bytes -= len(content)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "sampled": self.sampled,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "oversized": self.oversized,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES)
+
+# Aynı anda gelen özdeş isteklerin tek upstream çağrısında birleştirilmesi
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+@dataclass
+class _Flight:
+    """Upstream'de devam eden tek bir çağrı ve onu bekleyen istek sayısı"""
+    task: asyncio.Task
+    waiters: int = 0
+
+class SingleFlight:
+    """Özdeş in-flight istekleri tek bir upstream çağrısında birleştir"""
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        
+        # Sayaçlar
+        self.leaders = 0  # Upstream'e giden istekler
+        self.coalesced = 0  # Devam eden çağrıya bağlanan istekler
+        self.abandoned = 0  # Bekleyen kalmadığı için iptal edilen çağrılar
+        self.peak_waiters = 0
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """fn'i key başına bir kez çalıştır; (sonuç, başka bir isteğin sonucunu paylaştı mı) döner"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        
+        if flight is None:
+            flight = _Flight(task=asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        
+        flight.waiters += 1
+        self.peak_waiters = max(self.peak_waiters, flight.waiters)
+        try:
+            # shield: bir bekleyenin iptali diğerlerinin sonucunu etkilemesin
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # İptal edilen task hemen bitmeyebilir: yeni özdeş istek ona bağlanmasın, yeni çağrı açsın
+                self._forget(key, flight)
+                flight.task.cancel()
+                self.abandoned += 1
+    
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": COALESCE_REQUESTS,
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "peak_waiters": self.peak_waiters
+        }
+
+single_flight = SingleFlight()
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[Any], kind: str) -> Any:
+    """work'ü çalıştır; client koparsa iptal et (aiohttp/httpx çağrıları CancelledError ile kapanır)"""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=CLIENT_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                disconnect_stats.disconnects += 1
+                if kind == "decomposition":
+                    disconnect_stats.cancelled_decompositions += 1
+                else:
+                    disconnect_stats.cancelled_forwards += 1
+                raise ClientDisconnected(kind)
+    finally:
+        if not task.done():
+            task.cancel()
+
+def _cache_bypassed(headers) -> bool:
+    """Client cache'i atlamak istiyor mu? (Cache-Control: no-cache/no-store veya x-cache: bypass)"""
+    cache_control = (headers.get("cache-control") or "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return True
+    return (headers.get("x-cache") or "").lower() == "bypass"
+
+# Örnekleme yapan endpoint'ler: cevap sadece temperature 0 iken tekrarlanabilir
+SAMPLED_PATHS = ("/chat/completions", "/completions")
+
+def _cache_allowed(path: str, body: Dict[str, Any], headers) -> bool:
+    """Cevap cache'lenebilir mi? Deterministik istek (temperature: 0) veya client açıkça istedi (x-cache: force).
+    temperature yoksa upstream varsayılanı (1) geçerlidir: tekrar deneyen client farklı bir cevap bekler."""
+    if path not in SAMPLED_PATHS:
+        return True
+    if (headers.get("x-cache") or "").lower() == "force":
+        return True
+    return body.get("temperature") == 0
+
+def _track_upstream_start():
+    """Upstream çağrısı başlarken pool metriklerini güncelle"""
+    upstream_stats.requests_total += 1
+    if upstream_stats.in_flight >= UPSTREAM_MAX_CONNECTIONS:
+        upstream_stats.saturated_requests += 1
+    upstream_stats.in_flight += 1
+    upstream_stats.peak_in_flight = max(upstream_stats.peak_in_flight, upstream_stats.in_flight)
+
+def _track_upstream_end(error: Optional[Exception] = None):
+    """Upstream çağrısı bittiğinde pool metriklerini güncelle"""
+    upstream_stats.in_flight -= 1
+    if isinstance(error, httpx.PoolTimeout):
+        upstream_stats.pool_timeouts += 1
+    elif error is not None:
+        upstream_stats.errors += 1
+
+def create_http_client(litellm_url: str) -> httpx.AsyncClient:
+    """Keep-alive pool'lu paylaşımlı upstream client oluştur"""
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ UPSTREAM_HTTP2=1 ama 'h2' paketi yok, HTTP/1.1 kullanılıyor")
+            http2 = False
+    
+    logger.info(
+        f"✅ Upstream HTTP client initialized (max_connections={UPSTREAM_MAX_CONNECTIONS}, "
+        f"keepalive={UPSTREAM_MAX_KEEPALIVE}, http2={http2})"
+    )
+    
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+    )
+    
+    return httpx.AsyncClient(
+        base_url=litellm_url,
+        limits=limits,
+        http2=http2,
+        timeout=httpx.Timeout(300.0)
+    )
+
 @app.on_event("startup")
 async def startup_event():
     """Startup event"""
-    global haiku_planner
+    global haiku_planner, http_client, usage_monitor
     
     litellm_url = os.getenv("LITELLM_PROXY_URL", "http://localhost:4000")
     master_key = os.getenv("LITELLM_MASTER_KEY", "sk-default-key")
@@ -59,48 +437,143 @@ async def startup_event():
         config_path=config_path  # Config.yaml yolunu geç
     )
     
+    await haiku_planner.start()
+    
+    # Tokenizer'ı ilk istekten önce yükle ve ısıt
+    load_time = await asyncio.to_thread(haiku_planner.load_tokenizer)
+    if haiku_planner.encoder is not None:
+        logger.info(f"✅ Tokenizer loaded ({haiku_planner.TOKENIZER_ENCODING}) in {load_time:.3f}s")
+    else:
+        logger.warning(f"⚠️ Tokenizer unavailable after {load_time:.3f}s, using len(text)//4 estimate")
+    
     logger.info("✅ Haiku Planner initialized")
+    
+    http_client = create_http_client(litellm_url)
+    
+    if USAGE_TRACKING_ENABLED:
+        if UsageMonitor is None:
+            logger.warning("⚠️ monitoring-dashboard.py not found, usage tracking disabled")
+        else:
+            usage_monitor = await asyncio.to_thread(
+                UsageMonitor,
+                USAGE_DB_PATH,
+                batch_size=USAGE_BATCH_SIZE,
+                flush_interval=USAGE_FLUSH_INTERVAL,
+                queue_size=USAGE_QUEUE_SIZE
+            )
+            logger.info(f"📊 Usage tracking enabled ({USAGE_DB_PATH})")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Shutdown event"""
+    global http_client
+    
+    if haiku_planner is not None:
+        await haiku_planner.close()
+        logger.info("👋 Haiku Planner HTTP session closed")
+    
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+        logger.info("👋 Upstream HTTP client closed")
+    
+    if usage_monitor is not None:
+        # Kuyrukta bekleyen kullanım kayıtlarını yaz
+        await asyncio.to_thread(usage_monitor.close)
+        logger.info(f"👋 Usage monitor flushed ({usage_monitor.ingest_stats['written']} records written)")
 
 @app.post("/chat/completions")
 async def chat_completions(
     request: Request,
     x_decompose: Optional[str] = Header(None),
     x_quality: Optional[str] = Header("fast"),
-    x_max_cost: Optional[float] = Header(None)
+    x_max_cost: Optional[float] = Header(None),
+    x_prompt_cache: Optional[str] = Header(None),
+    x_race: Optional[str] = Header(None)
 ):
     """
     Chat completions endpoint with Haiku Planner support
     
     Headers:
-    - x-decompose: "1" to force decomposition
-    - x-quality: "fast" (default) or "deep"
+    - x-decompose: "1" to force decomposition, "0" to skip it (missing: "0" unless auto_decompose is enabled)
+    - x-quality: "fast" (default), "deep" or "auto" (per-chunk model by planner complexity score)
     - x-max-cost: maximum cost in USD
+    - x-prompt-cache: "1"/"0" to override the planner's shared prompt-cache prefix mode
+    - x-race: "1" to race a direct call against decomposition (first valid answer wins)
     """
     
+    request_start = time.time()
+    request_id = uuid.uuid4().hex
+    
     try:
         # Request body'yi oku
         body = await request.json()
         
-        # MVP: Streaming'i kapat (stream=false)
+        # Varsayılan: stream=false (client stream: true gönderirse SSE relay edilir)
         if "stream" not in body:
             body["stream"] = False
         
         # Headers'ı dict'e dönüştür
         headers = {
-            "x-decompose": x_decompose or "0",
+            # Header yoksa "0"; auto_decompose açıksa None: eşik / adaptif karar
+            "x-decompose": x_decompose or (None if haiku_planner.AUTO_DECOMPOSE else "0"),
             "x-quality": x_quality or "fast",
-            "x-max-cost": str(x_max_cost) if x_max_cost else None
+            "x-max-cost": str(x_max_cost) if x_max_cost else None,
+            "x-prompt-cache": x_prompt_cache
         }
         
         # Decomposition kontrolü
-        should_decompose = haiku_planner.should_decompose(body, headers)
+        should_decompose = await haiku_planner.should_decompose_async(body, headers)
         
         logger.info(f"📨 Request received - Decompose: {should_decompose}, Stream: {body.get('stream', False)}")
         
         if should_decompose:
             # Haiku Planner ile işle
             logger.info("🧠 Using Haiku Planner for large request")
-            result = await haiku_planner.process_request(body, headers)
+            
+            if body.get("stream"):
+                # Plan ve chunk sonuçlarını hazır oldukça SSE ile gönder
+                return StreamingResponse(
+                    stream_decomposition(body, headers, request.headers, request_id),
+                    media_type="text/event-stream",
+                    headers={
+                        "Cache-Control": "no-cache",
+                        "X-Accel-Buffering": "no"
+                    }
+                )
+            
+            if x_race == "1" and RACE_MODE_ENABLED:
+                direct_cost = haiku_planner.estimate_direct_cost(body)
+                if direct_cost <= RACE_MAX_DIRECT_COST:
+                    return await cancel_on_disconnect(
+                        request,
+                        race_decomposition(body, headers, request.headers, direct_cost, request_id),
+                        "decomposition"
+                    )
+                race_stats.skipped_cost_ceiling += 1
+                logger.info(f"🏁 Race skipped: direct call estimate ${direct_cost:.4f} > ${RACE_MAX_DIRECT_COST:.4f}")
+            
+            if COALESCE_REQUESTS and not _cache_bypassed(request.headers):
+                # Aynı büyük istek zaten işleniyorsa onun sonucunu bekle
+                flight_key = canonical_request_hash(
+                    "/chat/completions#decompose",
+                    {"body": body, "headers": headers},
+                    request.headers.get("authorization", "")
+                )
+                # Client koparsa sadece bu bekleyen düşer; son bekleyen de giderse single-flight işi iptal eder
+                result, shared = await cancel_on_disconnect(
+                    request,
+                    single_flight.do(flight_key, lambda: haiku_planner.process_request(body, headers)),
+                    "decomposition"
+                )
+            else:
+                result = await cancel_on_disconnect(
+                    request, haiku_planner.process_request(body, headers), "decomposition"
+                )
+                shared = False
+            
+            latency = time.time() - request_start
+            _record_decomposition(request.headers, request_id, latency, result, shared)
             
             if "error" in result:
                 return JSONResponse(
@@ -108,13 +581,29 @@ async def chat_completions(
                     content=result
                 )
             
+            if not shared and _decomposition_succeeded(result):
+                # Başka isteğin sonucunu paylaşanların gecikmesi yolu temsil etmez; kısmi sonucun maliyeti
+                # sadece başarılı chunk'ları içerir, adaptif karara ucuz/hızlı görünmemesi için bildirilmez
+                haiku_planner.record_outcome(body, True, latency, cost=result["haiku_planner"]["total_cost"])
+            
             return JSONResponse(content=result)
         
+        elif body.get("stream"):
+            # SSE chunk'larını geldikçe client'a aktar
+            logger.info("🌊 Streaming from LiteLLM proxy")
+            return await stream_from_litellm(body, request.headers, request_id)
+        
         else:
             # Normal LiteLLM proxy'ye yönlendir
             logger.info("➡️ Forwarding to LiteLLM proxy")
-            return await forward_to_litellm(body, request.headers)
+            response = await cancel_on_disconnect(request, forward_to_litellm(body, request.headers), "forward")
+            _record_forward(body, request.headers, response, time.time() - request_start, request_id)
+            return response
     
+    except ClientDisconnected as e:
+        # Cevabı okuyacak kimse yok; 499 (client closed request) sadece log/metrik içindir
+        logger.info(f"🔌 Client disconnected, {e} cancelled")
+        return Response(status_code=499)
     except json.JSONDecodeError:
         return JSONResponse(
             status_code=400,
@@ -127,40 +616,453 @@ async def chat_completions(
             content={"error": {"message": str(e), "type": "internal_error"}}
         )
 
-async def forward_to_litellm(body: Dict[str, Any], headers) -> JSONResponse:
-    """LiteLLM proxy'ye request'i yönlendir (MVP: Timeout uyumlu)"""
-    
-    litellm_url = os.getenv("LITELLM_PROXY_URL", "http://localhost:4000")
-    
+def _served_locally(response: Response) -> bool:
+    """Cevap upstream'e gitmeden (cache) veya başka isteğin çağrısından (coalescing) geldi"""
+    return response.headers.get("x-cache") == "HIT" or bool(response.headers.get("x-coalesced"))
+
+def _decomposition_succeeded(result: Dict[str, Any]) -> bool:
+    """Decomposition tam cevap verdi mi: hata yok, tüm chunk'lar başarılı ve sonuç kısmi değil"""
+    if "error" in result:
+        return False
+    summary = result.get("haiku_planner") or {}
+    return summary.get("chunks_successful") == summary.get("chunks_executed") and not summary.get("partial")
+
+# usage objesi için okunan en fazla byte (prompt/completion token detayları dahil birkaç yüz byte)
+USAGE_SLICE_BYTES = 2048
+_json_decoder = json.JSONDecoder()
+
+def _response_usage(response: Response) -> Optional[Dict[str, Any]]:
+    """Non-streaming cevap gövdesindeki usage bloğu. Gövdenin tamamı parse edilmez (event loop'ta, cevap
+    boyutuyla büyür): son "usage" anahtarının objesi küçük bir dilimden decode edilir.
+    İçerikteki tırnaklar kaçışlı (\\") olduğundan eşleşme sadece gerçek JSON anahtarıdır."""
+    if response.status_code != 200:
+        return None
+    body = response.body
+    key = body.rfind(b'"usage"')
+    if key < 0:
+        return None
+    window = body[key + 7:key + 7 + USAGE_SLICE_BYTES].decode("utf-8", errors="replace").lstrip(" \t\r\n:")
+    if not window.startswith("{"):
+        return None  # "usage": null
+    try:
+        usage, _ = _json_decoder.raw_decode(window)
+    except ValueError:
+        return None
+    return usage if isinstance(usage, dict) else None
+
+def _record_direct_outcome(body: Dict[str, Any], response: Response, latency: float,
+                           usage: Optional[Dict[str, Any]]):
+    """Gerçekten upstream'e giden başarılı direkt çağrıyı adaptif karara bildir"""
+    if haiku_planner is None or response.status_code != 200 or _served_locally(response):
+        return
+    haiku_planner.record_outcome(body, False, latency, usage=usage)
+
+def _usage_user(headers) -> str:
+    """Kullanım kaydındaki kullanıcı: x-user-id header'ı, yoksa API key'in hash'i (key'in kendisi saklanmaz)"""
+    user_id = headers.get("x-user-id")
+    if user_id:
+        return user_id
+    authorization = headers.get("authorization", "")
+    if not authorization:
+        return "anonymous"
+    return "key-" + hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:16]
+
+def record_usage(user_id: str, model: str, tokens: int, latency: float, success: bool,
+                 cost: Optional[float] = None, request_id: Optional[str] = None,
+                 parent_request_id: Optional[str] = None):
+    """Kullanım kaydını kuyruğa koy; bloklamaz, yazma UsageMonitor'ün writer thread'inde yapılır"""
+    if usage_monitor is None:
+        return
+    if cost is None:
+        cost = usage_monitor.estimate_cost(model, tokens)
+    usage_monitor.log_usage(UsageRecord(
+        user_id=user_id,
+        timestamp=datetime.now(),
+        model=model,
+        tokens_used=tokens,
+        request_count=1,
+        response_time=latency,
+        success=success,
+        cost_usd=cost,
+        request_id=request_id,
+        parent_request_id=parent_request_id
+    ))
+
+def _record_forward(body: Dict[str, Any], request_headers, response: Response, latency: float,
+                    request_id: str, observe: bool = True):
+    """Direkt çağrı: kullanım kaydı ve (chat istekleri için) adaptif karar gözlemi; gövde bir kez parse edilir"""
+    usage = _response_usage(response)
+    if observe:
+        _record_direct_outcome(body, response, latency, usage)
+    record_usage(
+        _usage_user(request_headers),
+        body.get("model", "unknown"),
+        (usage or {}).get("total_tokens", 0),
+        latency,
+        response.status_code == 200,
+        cost=0.0 if _served_locally(response) else None,  # Upstream'e gitmeyen cevap maliyetsiz
+        request_id=request_id
+    )
+
+def _record_decomposition(request_headers, request_id: str, latency: float, result: Dict[str, Any],
+                          shared: bool = False):
+    """Decomposition: üst istek kaydı ve ona bağlı chunk kayıtları.
+    Coalescing ile paylaşılan sonuçta chunk'lar asıl isteğe yazılmıştır, burada maliyetsiz tek kayıt düşer."""
+    if usage_monitor is None:
+        return
+    user_id = _usage_user(request_headers)
+    summary = result.get("haiku_planner") or {}
+    chunks = summary.get("chunks") or []
+    record_usage(
+        user_id,
+        "haiku-planner",
+        (result.get("usage") or {}).get("total_tokens", 0),
+        latency,
+        "error" not in result,
+        cost=0.0 if shared else summary.get("total_cost", sum(chunk["cost"] for chunk in chunks)),
+        request_id=request_id
+    )
+    if shared:
+        return
+    for chunk in chunks:
+        record_usage(
+            user_id,
+            chunk.get("model") or "unknown",
+            chunk["tokens_used"],
+            chunk["execution_time"],
+            chunk["success"],
+            cost=chunk["cost"],
+            parent_request_id=request_id
+        )
+
+def _usage_from_sse_tail(tail: bytes) -> Optional[Dict[str, Any]]:
+    """Stream'in son byte'larındaki usage bloğu (client stream_options.include_usage istediyse gelir)"""
+    for line in reversed(tail.split(b"\n")):
+        line = line.strip()
+        if not line.startswith(b"data: {") or b'"usage"' not in line:
+            continue
+        try:
+            usage = json.loads(line[6:]).get("usage")
+        except ValueError:
+            continue
+        if usage:
+            return usage
+    return None
+
+def _upstream_timeout(body: Dict[str, Any]) -> float:
+    """İstek boyutuna göre upstream timeout değeri"""
     # MVP: Büyük istekler için timeout (600 saniye = 10 dakika)
     max_tokens = body.get("max_tokens", 0)
     if max_tokens >= 15000:
-        timeout_value = 600.0  # 10 dakika
-    else:
-        timeout_value = 300.0  # 5 dakika
+        return 600.0  # 10 dakika
+    return 300.0  # 5 dakika
+
+async def _post_upstream(path: str, body: Dict[str, Any], authorization: str,
+                         cache_key: Optional[str] = None) -> Tuple[int, bytes, str]:
+    """Upstream'e tek POST at; (status, body, content-type) döner"""
+    
+    timeout_value = _upstream_timeout(body)
     
+    _track_upstream_start()
+    upstream_error = None
     try:
-        async with httpx.AsyncClient(timeout=timeout_value) as client:
-            response = await client.post(
-                f"{litellm_url}/chat/completions",
-                json=body,
-                headers={
-                    "Authorization": headers.get("authorization", ""),
-                    "Content-Type": "application/json"
-                }
-            )
-            
-            return JSONResponse(
-                status_code=response.status_code,
-                content=response.json()
-            )
+        response = await http_client.post(
+            path,
+            json=body,
+            headers={
+                "Authorization": authorization,
+                "Content-Type": "application/json"
+            },
+            timeout=timeout_value
+        )
     
     except Exception as e:
+        upstream_error = e
         logger.error(f"❌ LiteLLM forward error: {str(e)}")
+        error = {"error": {"message": f"LiteLLM error: {str(e)}", "type": "proxy_error"}}
+        return 502, json.dumps(error).encode("utf-8"), "application/json"
+    finally:
+        # İptal (client koptu, single-flight / race kaybedeni) BaseException'dır: in_flight her çıkışta düşer
+        _track_upstream_end(upstream_error)
+    
+    if cache_key is not None and response.status_code == 200:
+        response_cache.set(cache_key, response.content)
+    
+    return (
+        response.status_code,
+        response.content,
+        response.headers.get("content-type", "application/json")
+    )
+
+async def forward_to_litellm(body: Dict[str, Any], headers,
+                             path: str = "/chat/completions") -> Response:
+    """LiteLLM proxy'ye request'i yönlendir (MVP: Timeout uyumlu)"""
+    
+    authorization = headers.get("authorization", "")
+    bypass = _cache_bypassed(headers)
+    request_key = canonical_request_hash(path, body, authorization)
+    
+    # Exact-match response cache (sadece non-streaming istekler)
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED and not body.get("stream"):
+        if bypass:
+            response_cache.bypasses += 1
+        elif not _cache_allowed(path, body, headers):
+            response_cache.sampled += 1
+        else:
+            cache_key = request_key
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return Response(
+                    content=cached,
+                    media_type="application/json",
+                    headers={"x-cache": "HIT"}
+                )
+    
+    response_headers = {"x-cache": "MISS" if cache_key is not None else "BYPASS"}
+    
+    if COALESCE_REQUESTS and not bypass:
+        # Özdeş istek zaten upstream'deyse aynı cevabı paylaş
+        (status_code, content, content_type), shared = await single_flight.do(
+            request_key,
+            lambda: _post_upstream(path, body, authorization, cache_key)
+        )
+        if shared:
+            response_headers["x-coalesced"] = "1"
+    else:
+        status_code, content, content_type = await _post_upstream(path, body, authorization, cache_key)
+    
+    return Response(
+        content=content,
+        status_code=status_code,
+        media_type=content_type,
+        headers=response_headers
+    )
+
+async def stream_from_litellm(body: Dict[str, Any], headers, request_id: Optional[str] = None) -> Response:
+    """LiteLLM SSE cevabını buffer'lamadan client'a aktar"""
+    
+    start_time = time.time()
+    user_id = _usage_user(headers)
+    model = body.get("model", "unknown")
+    streaming_stats.streams_started += 1
+    
+    _track_upstream_start()
+    try:
+        upstream_request = http_client.build_request(
+            "POST",
+            "/chat/completions",
+            json=body,
+            headers={
+                "Authorization": headers.get("authorization", ""),
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            },
+            timeout=_upstream_timeout(body)  # Chunk'lar arası okuma timeout'u
+        )
+        response = await http_client.send(upstream_request, stream=True)
+    except asyncio.CancelledError:
+        _track_upstream_end()
+        raise
+    except Exception as e:
+        _track_upstream_end(e)
+        streaming_stats.streams_failed += 1
+        logger.error(f"❌ LiteLLM stream error: {str(e)}")
+        record_usage(user_id, model, 0, time.time() - start_time, False, request_id=request_id)
         return JSONResponse(
             status_code=502,
             content={"error": {"message": f"LiteLLM error: {str(e)}", "type": "proxy_error"}}
         )
+    
+    # Upstream hata döndürdüyse stream açmadan aynen ilet
+    if response.status_code != 200:
+        try:
+            error_body = await response.aread()
+        finally:
+            await response.aclose()
+            _track_upstream_end()
+        streaming_stats.streams_failed += 1
+        record_usage(user_id, model, 0, time.time() - start_time, False, request_id=request_id)
+        return Response(
+            content=error_body,
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type", "application/json")
+        )
+    
+    async def relay():
+        # StreamingResponse bir sonraki chunk'ı ancak client öncekini aldıktan sonra ister (backpressure)
+        first_byte_at = None
+        relayed = 0
+        error = None
+        completed = False  # Sadece upstream stream sonuna kadar iletildiyse True
+        tail = b""  # Usage bloğu için sadece son byte'lar tutulur
+        try:
+            async for chunk in response.aiter_raw():
+                if first_byte_at is None:
+                    first_byte_at = time.time()
+                relayed += len(chunk)
+                tail = (tail + chunk)[-4096:]
+                yield chunk
+            completed = True
+        except (asyncio.CancelledError, GeneratorExit) as e:
+            # Client kapattı: Starlette generator'ı iptal eder (CancelledError) ya da yield'de kapatır
+            # (aclose -> GeneratorExit); upstream stream'i de kapatıyoruz
+            error = e
+            disconnect_stats.disconnects += 1
+            disconnect_stats.cancelled_streams += 1
+            raise
+        except Exception as e:
+            error = e
+            logger.error(f"❌ LiteLLM stream interrupted: {str(e)}")
+        finally:
+            await response.aclose()
+            _track_upstream_end(error)
+            
+            duration = time.time() - start_time
+            ttfb = (first_byte_at - start_time) if first_byte_at else duration
+            streaming_stats.bytes_relayed += relayed
+            streaming_stats.total_ttfb += ttfb
+            streaming_stats.total_duration += duration
+            streaming_stats.last_ttfb = ttfb
+            streaming_stats.last_duration = duration
+            if completed:
+                streaming_stats.streams_completed += 1
+            else:
+                streaming_stats.streams_interrupted += 1
+            
+            logger.info(f"🌊 Stream finished - TTFB: {ttfb:.3f}s, Duration: {duration:.3f}s, Bytes: {relayed}")
+            
+            usage = _usage_from_sse_tail(tail)
+            record_usage(user_id, model, (usage or {}).get("total_tokens", 0), duration, completed,
+                         request_id=request_id)
+    
+    return StreamingResponse(
+        relay(),
+        status_code=200,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Nginx buffering'i kapat
+        }
+    )
+
+async def race_decomposition(body: Dict[str, Any], headers: Dict[str, str], request_headers,
+                             direct_cost: float, request_id: Optional[str] = None) -> Response:
+    """Direkt çağrı ile decomposition'ı yarıştır; ilk geçerli cevap kazanır, kaybeden iptal edilir.
+    Kısmi/başarısız chunk'lı decomposition sadece direkt çağrı da başarısız olduysa kabul edilir."""
+    
+    start_time = time.time()
+    race_stats.races += 1
+    
+    direct = asyncio.ensure_future(forward_to_litellm(body, request_headers))
+    decomposed = asyncio.ensure_future(haiku_planner.process_request(body, headers))
+    pending = {direct, decomposed}
+    
+    winner = None
+    response = None
+    direct_response = None
+    decomposition_result = None
+    outcome = {
+        "timestamp": start_time,
+        "model": body.get("model"),
+        "input_bytes": sum(len(text.encode("utf-8")) for text in haiku_planner._message_texts(body)),
+        "max_tokens": body.get("max_tokens"),
+        "direct_cost_estimate": round(direct_cost, 6)
+    }
+    
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            
+            if direct in done:
+                outcome["direct_latency"] = round(time.time() - start_time, 3)
+                try:
+                    direct_response = direct.result()
+                except Exception as e:
+                    logger.error(f"❌ Race direct call error: {str(e)}")
+                if direct_response is not None and direct_response.status_code == 200:
+                    winner = "direct"
+                    response = direct_response
+                    _record_forward(body, request_headers, direct_response, time.time() - start_time, request_id)
+            
+            if decomposed in done and winner is None:
+                outcome["decomposition_latency"] = round(time.time() - start_time, 3)
+                try:
+                    decomposition_result = decomposed.result()
+                except Exception as e:
+                    decomposition_result = {"error": {"message": str(e), "type": "planner_error"}}
+            
+            # Direkt çağrı hâlâ sürüyorsa sadece tam başarılı decomposition kazanır;
+            # kısmi sonuç (başarısız/timed out chunk'lar) ancak direkt çağrı da başarısız olduysa döner
+            if winner is None and decomposition_result is not None and (
+                    _decomposition_succeeded(decomposition_result)
+                    or ("error" not in decomposition_result and direct.done())):
+                winner = "decomposition"
+                response = JSONResponse(content=decomposition_result)
+                outcome["decomposition_cost"] = decomposition_result["haiku_planner"]["total_cost"]
+                latency = time.time() - start_time
+                if _decomposition_succeeded(decomposition_result):
+                    haiku_planner.record_outcome(body, True, latency, cost=outcome["decomposition_cost"])
+                _record_decomposition(request_headers, request_id, latency, decomposition_result)
+    finally:
+        # Kaybedeni (veya client koptuysa ikisini de) iptal et; kaybeden decomposition ayrı sayılır
+        for task in pending:
+            task.cancel(haiku_planner.RACE_LOSER_CANCEL if winner is not None and task is decomposed else None)
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    race_stats.losers_cancelled += len(pending)
+    if winner == "direct":
+        race_stats.direct_wins += 1
+    elif winner == "decomposition":
+        race_stats.decomposition_wins += 1
+    else:
+        race_stats.both_failed += 1
+        record_usage(_usage_user(request_headers), body.get("model", "unknown"), 0,
+                     time.time() - start_time, False, request_id=request_id)
+        if decomposition_result is not None:
+            response = JSONResponse(status_code=400, content=decomposition_result)
+        else:
+            response = direct_response
+    
+    outcome["winner"] = winner
+    outcome["latency"] = round(time.time() - start_time, 3)
+    outcome["loser_cancelled"] = bool(pending)
+    race_outcomes.append(outcome)
+    logger.info(f"🏁 Race outcome: {json.dumps(outcome)}")
+    
+    response.headers["x-race-winner"] = winner or "none"
+    return response
+
+async def stream_decomposition(body: Dict[str, Any], headers: Dict[str, str], request_headers=None,
+                               request_id: Optional[str] = None):
+    """Haiku Planner streaming event'lerini SSE formatına dönüştür"""
+    start_time = time.time()
+    events = haiku_planner.process_request_stream(body, headers)
+    chunks: List[Dict[str, Any]] = []
+    done_event = None
+    try:
+        async for event in events:
+            # Kullanım kaydı için chunk ve özet event'lerini topla (ayrıca parse gerekmez)
+            planner_event = event.get("haiku_planner") or {}
+            if planner_event.get("event") == "chunk":
+                chunks.append(planner_event)
+            elif planner_event.get("event") == "done":
+                done_event = event
+            yield f"data: {json.dumps(event)}\n\n"
+        yield "data: [DONE]\n\n"
+    except asyncio.CancelledError:
+        # Client kapattı: planner/chunk task'ları events.aclose() ile iptal edilir
+        disconnect_stats.disconnects += 1
+        disconnect_stats.cancelled_streams += 1
+        raise
+    finally:
+        await events.aclose()
+        if request_headers is not None:
+            if done_event is not None:
+                result = {"usage": done_event.get("usage"), "haiku_planner": {**done_event["haiku_planner"], "chunks": chunks}}
+            else:
+                result = {"error": "stream did not complete", "haiku_planner": {"chunks": chunks}}
+            _record_decomposition(request_headers, request_id, time.time() - start_time, result)
 
 @app.get("/health")
 async def health_check():
@@ -171,6 +1073,13 @@ async def health_check():
         "timestamp": __import__('datetime').datetime.now().isoformat()
     }
 
+@app.get("/haiku-planner/policy")
+async def haiku_policy():
+    """Adaptif decompose kararının öğrendiği güncel sınır"""
+    if not haiku_planner or haiku_planner.decomposition_policy is None:
+        return {"enabled": False}
+    return haiku_planner.decomposition_policy.boundary()
+
 @app.get("/haiku-planner/stats")
 async def haiku_stats():
     """Haiku Planner istatistikleri"""
@@ -178,9 +1087,16 @@ async def haiku_stats():
         "enabled": True,
         "large_request_threshold": 8000,
         "max_chunks": 3,
-        "max_internal_calls": 4,
+        "max_internal_calls": haiku_planner.MAX_INTERNAL_CALLS if haiku_planner else 4,
         "planner_model": "autox",
-        "max_cost_per_request": 1.0
+        "max_cost_per_request": 1.0,
+        "plan_cache": haiku_planner.plan_cache.stats() if haiku_planner and haiku_planner.plan_cache else None,
+        "tokenizer": haiku_planner.tokenizer_stats if haiku_planner else None,
+        "cancellation": haiku_planner.cancellation_stats if haiku_planner else None,
+        "retries": haiku_planner.retry_stats if haiku_planner else None,
+        "routing": haiku_planner.routing_stats if haiku_planner else None,
+        "token_cache": haiku_planner.token_cache.stats() if haiku_planner else None,
+        "prompt_cache": haiku_planner.prompt_cache_stats if haiku_planner else None
     }
 
 @app.post("/haiku-planner/test")
@@ -201,33 +1117,74 @@ async def test_haiku_planner(request: Request):
             content={"error": str(e)}
         )
 
+@app.get("/proxy/stats")
+async def proxy_stats():
+    """Proxy seviyesindeki metrikler (upstream connection pool vb.)"""
+    relayed_streams = streaming_stats.streams_completed + streaming_stats.streams_interrupted
+    
+    return {
+        "upstream_pool": {
+            **asdict(upstream_stats),
+            "max_connections": UPSTREAM_MAX_CONNECTIONS,
+            "max_keepalive_connections": UPSTREAM_MAX_KEEPALIVE,
+            "keepalive_expiry": UPSTREAM_KEEPALIVE_EXPIRY,
+            "http2": UPSTREAM_HTTP2,
+            "utilization": round(upstream_stats.in_flight / UPSTREAM_MAX_CONNECTIONS, 3)
+        },
+        "response_cache": response_cache.stats(),
+        "coalescing": single_flight.stats(),
+        "disconnects": asdict(disconnect_stats),
+        "usage_tracking": usage_monitor.ingest_stats if usage_monitor else {"enabled": False},
+        "race": {
+            **asdict(race_stats),
+            "enabled": RACE_MODE_ENABLED,
+            "max_direct_cost": RACE_MAX_DIRECT_COST,
+            "recent_outcomes": list(race_outcomes)[-20:]
+        },
+        "streaming": {
+            **asdict(streaming_stats),
+            "avg_ttfb": round(streaming_stats.total_ttfb / relayed_streams, 3) if relayed_streams else 0.0,
+            "avg_duration": round(streaming_stats.total_duration / relayed_streams, 3) if relayed_streams else 0.0
+        }
+    }
+
 # Diğer endpoints (pass-through)
 @app.post("/completions")
 async def completions(request: Request):
     """Completions endpoint"""
     body = await request.json()
-    return await forward_to_litellm(body, request.headers)
+    start_time = time.time()
+    try:
+        response = await cancel_on_disconnect(
+            request, forward_to_litellm(body, request.headers, "/completions"), "forward"
+        )
+        _record_forward(body, request.headers, response, time.time() - start_time, uuid.uuid4().hex, observe=False)
+        return response
+    except ClientDisconnected:
+        return Response(status_code=499)
 
 @app.post("/embeddings")
 async def embeddings(request: Request):
     """Embeddings endpoint"""
     body = await request.json()
-    return await forward_to_litellm(body, request.headers)
+    return await forward_to_litellm(body, request.headers, "/embeddings")
 
 @app.get("/models")
 async def list_models():
     """List available models"""
-    litellm_url = os.getenv("LITELLM_PROXY_URL", "http://localhost:4000")
-    
+    _track_upstream_start()
+    upstream_error = None
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{litellm_url}/models")
-            return response.json()
+        response = await http_client.get("/models")
+        return response.json()
     except Exception as e:
+        upstream_error = e
         return JSONResponse(
             status_code=502,
             content={"error": str(e)}
         )
+    finally:
+        _track_upstream_end(upstream_error)
 
 if __name__ == "__main__":
     import uvicorn
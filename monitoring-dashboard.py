@@ -6,7 +6,10 @@ Kullanıcı kullanımını izleme ve raporlama sistemi
 
 import asyncio
 import aiohttp
+import atexit
+import queue
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional
@@ -24,6 +27,8 @@ class UsageRecord:
     response_time: float
     success: bool
     cost_usd: float
+    request_id: Optional[str] = None  # Proxy'nin istek id'si
+    parent_request_id: Optional[str] = None  # Decomposition chunk kayıtlarında üst isteğin id'si
 
 @dataclass
 class UserStats:
@@ -41,12 +46,54 @@ class UserStats:
     monthly_tokens: int
 
 class UsageMonitor:
-    """Kullanım izleme sınıfı"""
+    """Kullanım izleme sınıfı.
+    log_usage kaydı sadece kuyruğa koyar; arka plandaki writer thread kayıtları
+    batch_size veya flush_interval eşiğinde tek transaction'da executemany ile yazar."""
     
-    def __init__(self, db_path: str = "usage_monitor.db"):
+    OVERFLOW_POLICIES = ("drop", "block")
+    SCHEMA_VERSION = 2  # PRAGMA user_version; init_database eksik migration'ları sırayla uygular
+    BACKFILL_MAX_BACKOFF = 60.0  # saniye - hata veren backfill adımının en uzun tekrar deneme aralığı
+    
+    def __init__(self, db_path: str = "usage_monitor.db",
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 queue_size: int = 10000,
+                 overflow_policy: str = "drop",
+                 enqueue_timeout: float = 0.05,
+                 backfill_batch: int = 5000,
+                 backfill_interval: float = 0.1):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {self.OVERFLOW_POLICIES}")
+        
         self.db_path = db_path
+        self._backfill_pending = False  # Eski tablo hâlâ var: okumalar onu da birleştirir
+        self._backfill_failures = 0  # Art arda hata veren backfill adımları (backoff için)
+        self._backfill_retry_at = 0.0  # time.monotonic() - hatadan sonra bir sonraki deneme zamanı
         self.init_database()
         
+        # Batch ingestion ayarları
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # saniye - yarım batch en fazla bu kadar bekler
+        self.overflow_policy = overflow_policy  # drop: kuyruk doluysa kaydı at, block: enqueue_timeout kadar bekle
+        self.enqueue_timeout = enqueue_timeout
+        # Online backfill: writer boştayken eski şemadaki satırları bu boyutta parçalarla taşır (0: sadece migrate())
+        self.backfill_batch = backfill_batch
+        self.backfill_interval = backfill_interval  # saniye - backfill adımları arasında yeni kayıt bekleme süresi
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+        self._model_ids: Dict[str, int] = {}  # Writer thread'in model adı -> models.id önbelleği
+        self.ingest_stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,  # Kuyruk dolu olduğu için atılan kayıtlar
+            "blocked": 0,  # Kuyruk dolu olduğu için bekleyen enqueue çağrıları (block policy)
+            "flushes": 0,
+            "write_errors": 0,
+            "backfilled": 0  # Eski şemadan taşınan satırlar
+        }
+        
         # Model maliyetleri (USD/1M token)
         self.model_costs = {
             "gpt-4": 45.0,  # ortalama input/output
@@ -61,12 +108,38 @@ class UsageMonitor:
             "sonnet-4-x": 45.0,  # Claude-4 Sonnet tahmini
             "sonnet-4-5-x": 45.0
         }
+        
+        # Taşınacak eski satır varsa backfill hemen arka planda başlasın
+        if self._backfill_pending and self.backfill_batch > 0:
+            self._ensure_writer()
     
     def init_database(self):
-        """Veritabanını başlat"""
+        """Veritabanını başlat ve şemayı SCHEMA_VERSION'a getir"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WAL: writer commit'leri okuyucuları (raporlar) bloklamaz; mod dosyada kalıcıdır
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Migration'lar tek transaction'da; aynı anda başlayan process'lerden sadece biri uygular (IMMEDIATE)
+        cursor.execute("BEGIN IMMEDIATE")
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        migrations = (self._migrate_v1, self._migrate_v2)
+        for target in range(version + 1, self.SCHEMA_VERSION + 1):
+            migrations[target - 1](cursor)
+            cursor.execute(f"PRAGMA user_version = {target}")
+        
+        # Rollup'lar yeni oluşturulduysa mevcut satırlardan doldur
+        if cursor.execute("SELECT 1 FROM usage_hourly LIMIT 1").fetchone() is None:
+            self._build_rollups(cursor, self._has_legacy(cursor))
+        
+        self._backfill_pending = self._has_legacy(cursor)
+        conn.commit()
+        conn.close()
+    
+    def _migrate_v1(self, cursor: sqlite3.Cursor):
+        """Şema v1: metin timestamp, satırda model adı, istek bağlantı kolonları, rollup tabloları.
+        user_version'dan önce oluşturulmuş veritabanları da v0 sayılır; adımlar bu yüzden idempotent."""
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS usage_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -92,156 +165,749 @@ class UsageMonitor:
             ON usage_logs(timestamp)
         ''')
         
-        conn.commit()
-        conn.close()
-    
-    def log_usage(self, record: UsageRecord):
-        """Kullanım kaydı ekle"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Eski veritabanlarında istek bağlantı kolonları yok
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(usage_logs)")}
+        for column in ("request_id", "parent_request_id"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE usage_logs ADD COLUMN {column} TEXT")
         
         cursor.execute('''
-            INSERT INTO usage_logs 
-            (user_id, timestamp, model, tokens_used, request_count, 
-             response_time, success, cost_usd)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            record.user_id,
-            record.timestamp,
-            record.model,
-            record.tokens_used,
-            record.request_count,
-            record.response_time,
-            record.success,
-            record.cost_usd
-        ))
+            CREATE INDEX IF NOT EXISTS idx_request 
+            ON usage_logs(request_id)
+        ''')
         
-        conn.commit()
-        conn.close()
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_parent_request 
+            ON usage_logs(parent_request_id)
+        ''')
+        
+        # Rollup tabloları: kullanıcı x model x saat / gün toplamları (sadece üst seviye istekler).
+        # Batch yazımıyla aynı transaction'da güncellenir; raporlar ve limit kontrolleri buradan okur.
+        for table, bucket in (("usage_hourly", "hour"), ("usage_daily", "day")):
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    user_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    {bucket} TEXT NOT NULL,
+                    requests INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    cost_usd REAL NOT NULL,
+                    response_time_sum REAL NOT NULL,
+                    successes INTEGER NOT NULL,
+                    last_activity DATETIME NOT NULL,
+                    PRIMARY KEY (user_id, {bucket}, model)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_{table}_{bucket} 
+                ON {table}({bucket})
+            ''')
     
-    def get_user_stats(self, user_id: str, days: int = 30) -> Optional[UserStats]:
-        """Kullanıcı istatistiklerini getir"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _migrate_v2(self, cursor: sqlite3.Cursor):
+        """Şema v2: epoch saniye (INTEGER) timestamp, model adı models lookup tablosunda,
+        ham satır sorgularını tablo okumadan karşılayan covering index'ler.
+        Eski tablo usage_logs_legacy adıyla kalır; satırları writer boştayken parça parça kopyalanır.
+        usage_backfill.watermark: bu id ve üstündeki eski satırlar kopyalandı, okuyucular eski tablodan altını okur."""
+        cursor.execute("ALTER TABLE usage_logs RENAME TO usage_logs_legacy")
         
-        # Tarih aralıkları
-        now = datetime.now()
-        month_ago = now - timedelta(days=days)
-        day_ago = now - timedelta(days=1)
+        cursor.execute('''
+            CREATE TABLE models (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
         
-        # Toplam istatistikler
         cursor.execute('''
-            SELECT 
-                COUNT(*) as total_requests,
-                SUM(tokens_used) as total_tokens,
-                SUM(cost_usd) as total_cost,
-                AVG(response_time) as avg_response_time,
-                AVG(CASE WHEN success THEN 1.0 ELSE 0.0 END) as success_rate,
-                MAX(timestamp) as last_activity
-            FROM usage_logs 
-            WHERE user_id = ? AND timestamp >= ?
-        ''', (user_id, month_ago))
+            CREATE TABLE usage_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                model_id INTEGER NOT NULL REFERENCES models(id),
+                tokens_used INTEGER NOT NULL,
+                request_count INTEGER NOT NULL DEFAULT 1,
+                response_time REAL NOT NULL,
+                success INTEGER NOT NULL,
+                cost_usd REAL NOT NULL,
+                request_id TEXT,
+                parent_request_id TEXT,
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+            )
+        ''')
         
-        result = cursor.fetchone()
-        if not result or result[0] == 0:
-            conn.close()
-            return None
+        # Yeni kayıtların id'leri taşınacak eski id'lerin üstünden başlasın (id sırası = kayıt sırası)
+        cursor.execute('''
+            INSERT INTO sqlite_sequence (name, seq) 
+            SELECT 'usage_logs', COALESCE(MAX(id), 0) FROM usage_logs_legacy
+        ''')
         
-        # Günlük istatistikler
+        # Pencere toplamları (kullanıcı bazında ve tüm kullanıcılar): sadece üst seviye istekler (partial index).
+        # parent_request_id hep NULL ama kolonda olmalı; yoksa SQLite index'i covering saymaz.
         cursor.execute('''
-            SELECT 
-                COUNT(*) as daily_requests,
-                SUM(tokens_used) as daily_tokens
-            FROM usage_logs 
-            WHERE user_id = ? AND timestamp >= ?
-        ''', (user_id, day_ago))
+            CREATE INDEX idx_logs_user_ts 
+            ON usage_logs(user_id, ts, model_id, tokens_used, cost_usd, response_time, success, parent_request_id)
+            WHERE parent_request_id IS NULL
+        ''')
         
-        daily_result = cursor.fetchone()
+        cursor.execute('''
+            CREATE INDEX idx_logs_ts 
+            ON usage_logs(ts, user_id, model_id, tokens_used, cost_usd, response_time, success, parent_request_id)
+            WHERE parent_request_id IS NULL
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX idx_logs_request 
+            ON usage_logs(request_id) WHERE request_id IS NOT NULL
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX idx_logs_parent_request 
+            ON usage_logs(parent_request_id) WHERE parent_request_id IS NOT NULL
+        ''')
+        
+        cursor.execute("CREATE TABLE usage_backfill (watermark INTEGER NOT NULL)")
+        cursor.execute("INSERT INTO usage_backfill SELECT COALESCE(MAX(id), 0) + 1 FROM usage_logs_legacy")
+        
+        if cursor.execute("SELECT 1 FROM usage_logs_legacy LIMIT 1").fetchone() is None:
+            self._finish_backfill(cursor)
+    
+    def _finish_backfill(self, cursor):
+        """Tüm eski satırlar kopyalandı: v1 tablosunu (index'leriyle) kaldır"""
+        cursor.execute("DROP TABLE usage_logs_legacy")
+        cursor.execute("DROP TABLE usage_backfill")
+        self._backfill_pending = False
+    
+    def _has_legacy(self, cursor) -> bool:
+        """Backfill'i bitmemiş v1 tablosu var mı"""
+        return cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_logs_legacy'"
+        ).fetchone() is not None
+    
+    def _backfill_step(self, conn: sqlite3.Connection, batch_rows: int) -> int:
+        """Watermark'ın altındaki en yeni batch_rows eski satırı v2 tablosuna kopyala (tek kısa transaction).
+        Kopya ve watermark aynı commit'te ilerler; okuyucular her satırı iki tablodan sadece birinde görür.
+        Eski satırlar silinmez (index bakımı kopyadan pahalı), tablo backfill bitince toptan kaldırılır."""
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if not self._has_legacy(conn):
+                self._backfill_pending = False  # Başka bir process bitirdi
+                return 0
+            
+            watermark = conn.execute("SELECT watermark FROM usage_backfill").fetchone()[0]
+            low = conn.execute('''
+                SELECT MIN(id) FROM (
+                    SELECT id FROM usage_logs_legacy WHERE id < ? ORDER BY id DESC LIMIT ?
+                )
+            ''', (watermark, batch_rows)).fetchone()[0]
+            if low is None:
+                self._finish_backfill(conn)
+                return 0
+            
+            conn.execute('''
+                INSERT OR IGNORE INTO models (name) 
+                SELECT DISTINCT model FROM usage_logs_legacy WHERE id >= ? AND id < ?
+            ''', (low, watermark))
+            # Metin timestamp yerel saat: 'utc' ile epoch'a çevrilir. Kesir atılır (SQLite ms'ye yuvarlar,
+            # datetime.timestamp() kesilir); böylece saat sınırındaki satırlar eski sorgulardaki pencerede kalır.
+            moved = conn.execute('''
+                INSERT INTO usage_logs 
+                (id, user_id, ts, model_id, tokens_used, request_count, response_time, 
+                 success, cost_usd, request_id, parent_request_id, created_at)
+                SELECT 
+                    legacy.id,
+                    legacy.user_id,
+                    CAST(strftime('%s', substr(legacy.timestamp, 1, 19), 'utc') AS INTEGER),
+                    models.id,
+                    legacy.tokens_used,
+                    COALESCE(legacy.request_count, 1),
+                    legacy.response_time,
+                    CASE WHEN legacy.success THEN 1 ELSE 0 END,
+                    legacy.cost_usd,
+                    legacy.request_id,
+                    legacy.parent_request_id,
+                    COALESCE(CAST(strftime('%s', legacy.created_at) AS INTEGER), 
+                             CAST(strftime('%s', substr(legacy.timestamp, 1, 19), 'utc') AS INTEGER))
+                FROM usage_logs_legacy AS legacy
+                JOIN models ON models.name = legacy.model
+                WHERE legacy.id >= ? AND legacy.id < ?
+            ''', (low, watermark)).rowcount
+            conn.execute("UPDATE usage_backfill SET watermark = ?", (low,))
+            
+            if conn.execute("SELECT 1 FROM usage_logs_legacy WHERE id < ? LIMIT 1", (low,)).fetchone() is None:
+                self._finish_backfill(conn)
+        return moved
+    
+    def migrate(self, batch_rows: int = 50000) -> int:
+        """Online backfill'i beklemeden bitir (bakım penceresi / benchmark); taşınan satır sayısını döner"""
+        conn = self._connect_writer()
+        moved = 0
+        try:
+            while self._backfill_pending:
+                moved += self._backfill_step(conn, batch_rows)
+        finally:
+            conn.close()
+        if moved:
+            print(f"✅ Usage şeması v{self.SCHEMA_VERSION}: {moved:,} satır taşındı")
+        return moved
+    
+    def _build_rollups(self, cursor: sqlite3.Cursor, legacy: bool = False):
+        """Rollup tablolarını ham satırlardan yeniden hesapla (backfill sürüyorsa eski tablo dahil)"""
+        legacy_rows = '''
+            UNION ALL
+            SELECT 
+                user_id,
+                model,
+                substr(timestamp, 1, 13) || ':00:00',
+                COUNT(*),
+                SUM(tokens_used),
+                SUM(cost_usd),
+                SUM(response_time),
+                SUM(CASE WHEN success THEN 1 ELSE 0 END),
+                MAX(timestamp)
+            FROM usage_logs_legacy 
+            WHERE parent_request_id IS NULL AND id < (SELECT watermark FROM usage_backfill)
+            GROUP BY 1, 2, 3
+        ''' if legacy else ""
         
-        # Aylık istatistikler
+        cursor.execute("DELETE FROM usage_hourly")
+        cursor.execute("DELETE FROM usage_daily")
+        cursor.execute(f'''
+            INSERT INTO usage_hourly 
+            SELECT user_id, model, hour, SUM(requests), SUM(tokens), SUM(cost_usd), 
+                   SUM(response_time_sum), SUM(successes), MAX(last_activity)
+            FROM (
+                SELECT 
+                    raw.user_id,
+                    models.name AS model,
+                    strftime('%Y-%m-%d %H:00:00', raw.slot_ts, 'unixepoch', 'localtime') AS hour,
+                    raw.requests,
+                    raw.tokens,
+                    raw.cost_usd,
+                    raw.response_time_sum,
+                    raw.successes,
+                    datetime(raw.last_ts, 'unixepoch', 'localtime') AS last_activity
+                FROM (
+                    SELECT 
+                        user_id,
+                        model_id,
+                        ts - ts % 900 AS slot_ts,  -- 15 dk dilim: saat dilimi ofsetleri 15 dk'nın katı, dilim yerel saat sınırını aşmaz
+                        COUNT(*) AS requests,
+                        SUM(tokens_used) AS tokens,
+                        SUM(cost_usd) AS cost_usd,
+                        SUM(response_time) AS response_time_sum,
+                        SUM(success) AS successes,
+                        MAX(ts) AS last_ts
+                    FROM usage_logs 
+                    WHERE parent_request_id IS NULL
+                    GROUP BY 1, 2, 3
+                ) AS raw
+                JOIN models ON models.id = raw.model_id
+                {legacy_rows}
+            )
+            GROUP BY 1, 2, 3
+        ''')
         cursor.execute('''
+            INSERT INTO usage_daily 
             SELECT 
-                COUNT(*) as monthly_requests,
-                SUM(tokens_used) as monthly_tokens
-            FROM usage_logs 
-            WHERE user_id = ? AND timestamp >= ?
-        ''', (user_id, month_ago))
+                user_id,
+                model,
+                substr(hour, 1, 10),
+                SUM(requests),
+                SUM(tokens),
+                SUM(cost_usd),
+                SUM(response_time_sum),
+                SUM(successes),
+                MAX(last_activity)
+            FROM usage_hourly 
+            GROUP BY 1, 2, 3
+        ''')
+    
+    def rebuild_rollups(self):
+        """Rollup tablolarını ham satırlardan yeniden oluştur (toplu import veya elle düzeltme sonrası)"""
+        self.flush()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        self._build_rollups(cursor, self._has_legacy(cursor))
+        conn.commit()
+        conn.close()
+    
+    def log_usage(self, record: UsageRecord) -> bool:
+        """Kullanım kaydını yazma kuyruğuna ekle (bloklamaz). Kayıt atıldıysa False döner."""
+        if self._closed:
+            self.ingest_stats["dropped"] += 1
+            return False
+        self._ensure_writer()
         
-        monthly_result = cursor.fetchone()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow_policy == "drop":
+                self.ingest_stats["dropped"] += 1
+                return False
+            # Backpressure: kısa süre bekle, writer yetişemiyorsa yine de at
+            self.ingest_stats["blocked"] += 1
+            try:
+                self._queue.put(record, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self.ingest_stats["dropped"] += 1
+                return False
         
+        self.ingest_stats["enqueued"] += 1
+        return True
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Kuyruktaki tüm kayıtların yazılmasını bekle"""
+        if self._writer is None or not self._writer.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+    
+    def close(self, timeout: Optional[float] = 10.0):
+        """Kuyruğu boşalt, writer'ı durdur (process kapanırken atexit ile de çağrılır)"""
+        with self._writer_lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)  # Stop sinyali: writer önce kalan batch'i yazar
+            self._writer.join(timeout)
+    
+    def _ensure_writer(self):
+        """Writer thread'i ilk kayıtta başlat"""
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="usage-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+    
+    def _connect_writer(self) -> sqlite3.Connection:
+        """Writer thread'in kalıcı bağlantısı"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL'da commit başına fsync yok, checkpoint'te var
+        conn.execute("PRAGMA cache_size=-32768")  # 32 MB: index sayfaları (özellikle backfill sırasında) cache'te kalsın
+        return conn
+    
+    def _writer_loop(self):
+        """Kayıtları topla; batch dolunca, flush_interval dolunca veya flush/close istenince yaz"""
+        conn = self._connect_writer()
+        batch: List[UsageRecord] = []
+        flush_at = None
+        
+        try:
+            while True:
+                timeout = None if flush_at is None else max(flush_at - time.monotonic(), 0)
+                if timeout is None and self._backfill_pending and self.backfill_batch > 0:
+                    timeout = max(self.backfill_interval, self._backfill_retry_at - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    if flush_at is None:
+                        if time.monotonic() >= self._backfill_retry_at:
+                            self._run_backfill_step(conn)  # Boşta: eski şemadan bir parça taşı
+                        continue
+                    item = False  # Süre doldu
+                
+                if isinstance(item, UsageRecord):
+                    batch.append(item)
+                    if flush_at is None:
+                        flush_at = time.monotonic() + self.flush_interval
+                    if len(batch) < self.batch_size:
+                        continue
+                
+                if batch:
+                    self._write_batch(conn, batch)
+                    batch = []
+                flush_at = None
+                
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    break
+        finally:
+            conn.close()
+    
+    def _run_backfill_step(self, conn: sqlite3.Connection):
+        """Writer thread'den bir backfill adımı; hata olursa (ör. kilit) artan aralıklarla tekrar denenir.
+        Duraklama okumaları etkilemez: eski tablo durdukça kopyalanmamış satırlar oradan okunur."""
+        try:
+            self.ingest_stats["backfilled"] += self._backfill_step(conn, self.backfill_batch)
+        except Exception as e:
+            self._backfill_failures += 1
+            delay = min(self.backfill_interval * 2 ** self._backfill_failures, self.BACKFILL_MAX_BACKOFF)
+            self._backfill_retry_at = time.monotonic() + delay
+            print(f"⚠️ Usage backfill duraklatıldı ({delay:.1f}s sonra tekrar denenecek): {e}")
+        else:
+            self._backfill_failures = 0
+    
+    def _model_id(self, conn: sqlite3.Connection, model: str) -> int:
+        """Model adının models.id karşılığı (önbellekte yoksa tabloya eklenir)"""
+        model_id = self._model_ids.get(model)
+        if model_id is None:
+            conn.execute("INSERT OR IGNORE INTO models (name) VALUES (?)", (model,))
+            model_id = conn.execute("SELECT id FROM models WHERE name = ?", (model,)).fetchone()[0]
+            self._model_ids[model] = model_id
+        return model_id
+    
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[UsageRecord]):
+        """Batch'i tek transaction'da yaz; hata writer thread'i durdurmaz, yazılamayan kayıtlar dropped sayılır"""
+        try:
+            with conn:
+                rows = [
+                    (
+                        record.user_id,
+                        int(record.timestamp.timestamp()),
+                        self._model_id(conn, record.model),
+                        record.tokens_used,
+                        record.request_count,
+                        record.response_time,
+                        1 if record.success else 0,
+                        record.cost_usd,
+                        record.request_id,
+                        record.parent_request_id
+                    ) for record in batch
+                ]
+                conn.executemany('''
+                    INSERT INTO usage_logs 
+                    (user_id, ts, model_id, tokens_used, request_count, 
+                     response_time, success, cost_usd, request_id, parent_request_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                self._update_rollups(conn, batch)
+        except Exception as e:
+            self._model_ids.clear()  # Rollback yeni eklenen model satırlarını da geri almış olabilir
+            if len(batch) > 1 and not isinstance(e, sqlite3.Error):
+                # Bozuk kayıt (ör. datetime olmayan timestamp): kayıt kayıt yaz, sadece bozuk olanlar atılsın
+                for record in batch:
+                    self._write_batch(conn, [record])
+                return
+            self.ingest_stats["write_errors"] += 1
+            self.ingest_stats["dropped"] += len(batch)
+            print(f"❌ Usage batch yazılamadı ({len(batch)} kayıt): {e}")
+            return
+        
+        self.ingest_stats["written"] += len(batch)
+        self.ingest_stats["flushes"] += 1
+    
+    def _update_rollups(self, conn: sqlite3.Connection, batch: List[UsageRecord]):
+        """Batch'i önce bellekte saat/gün bazında topla, sonra rollup'lara upsert et"""
+        buckets: Dict[tuple, List[Any]] = {}
+        for record in batch:
+            if record.parent_request_id is not None:
+                continue  # Chunk kayıtları üst isteğin içinde sayılır
+            timestamp = record.timestamp.isoformat(" ")
+            for table, bucket in (("usage_hourly", timestamp[:13] + ":00:00"), ("usage_daily", timestamp[:10])):
+                key = (table, record.user_id, record.model, bucket)
+                totals = buckets.get(key)
+                if totals is None:
+                    buckets[key] = [1, record.tokens_used, record.cost_usd, record.response_time,
+                                    1 if record.success else 0, timestamp]
+                else:
+                    totals[0] += 1
+                    totals[1] += record.tokens_used
+                    totals[2] += record.cost_usd
+                    totals[3] += record.response_time
+                    totals[4] += 1 if record.success else 0
+                    totals[5] = max(totals[5], timestamp)
+        
+        for table, bucket in (("usage_hourly", "hour"), ("usage_daily", "day")):
+            conn.executemany(f'''
+                INSERT INTO {table} 
+                (user_id, model, {bucket}, requests, tokens, cost_usd, response_time_sum, successes, last_activity)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, {bucket}, model) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    tokens = tokens + excluded.tokens,
+                    cost_usd = cost_usd + excluded.cost_usd,
+                    response_time_sum = response_time_sum + excluded.response_time_sum,
+                    successes = successes + excluded.successes,
+                    last_activity = MAX(last_activity, excluded.last_activity)
+            ''', [key[1:] + tuple(totals) for key, totals in buckets.items() if key[0] == table])
+    
+    def estimate_cost(self, model: str, tokens: int) -> float:
+        """Token sayısından USD maliyet tahmini"""
+        return (tokens / 1_000_000) * self.model_costs.get(model, 10.0)
+    
+    def get_request_breakdown(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """Bir isteğin kaydı ve (decomposition ise) chunk kayıtları: sürenin nereye gittiği"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        legacy = self._begin_read(cursor)
+        
+        legacy_rows = '''
+            UNION ALL
+            SELECT id, parent_request_id, model, tokens_used, response_time, success, cost_usd
+            FROM usage_logs_legacy 
+            WHERE (request_id = :request_id OR parent_request_id = :request_id)
+                AND id < (SELECT watermark FROM usage_backfill)
+        ''' if legacy else ""
+        cursor.execute(f'''
+            SELECT logs.id, logs.parent_request_id, models.name, logs.tokens_used, 
+                   logs.response_time, logs.success, logs.cost_usd
+            FROM usage_logs AS logs
+            JOIN models ON models.id = logs.model_id
+            WHERE logs.request_id = :request_id OR logs.parent_request_id = :request_id
+            {legacy_rows}
+            ORDER BY 1
+        ''', {"request_id": request_id})
+        rows = cursor.fetchall()
         conn.close()
         
+        records = [
+            {
+                "model": row[2],
+                "tokens": row[3],
+                "response_time": row[4],
+                "success": bool(row[5]),
+                "cost": row[6]
+            } for row in rows
+        ]
+        parent = [record for record, row in zip(records, rows) if row[1] is None]
+        if not parent:
+            return None
+        return {
+            "request_id": request_id,
+            "request": parent[0],
+            "chunks": [record for record, row in zip(records, rows) if row[1] is not None]
+        }
+    
+    def _begin_read(self, cursor: sqlite3.Cursor) -> bool:
+        """Backfill sürerken okumayı tek snapshot'ta yap; eski tablo da okunacaksa True.
+        Karar backfill'in duraklamasına değil eski tablonun varlığına bağlıdır (tablo son satır kopyalanınca kalkar).
+        Watermark ve kopyalar aynı snapshot'tan okunur: hiçbir satır iki kez ya da hiç sayılmaz."""
+        if not self._backfill_pending:
+            return False
+        cursor.execute("BEGIN")
+        legacy = self._has_legacy(cursor)
+        if not legacy:
+            self._backfill_pending = False
+        return legacy
+    
+    def _window_edges(self, prefix: str, since: datetime) -> Dict[str, Any]:
+        """[since, şimdi) penceresinin parçaları: baştaki yarım saat ham satırlardan,
+        ilk günün kalan saatleri saatlik rollup'tan, sonraki günler (bugün dahil) günlük rollup'tan"""
+        hour_edge = since.replace(minute=0, second=0, microsecond=0)
+        if hour_edge < since:
+            hour_edge += timedelta(hours=1)
+        day_edge = hour_edge.replace(hour=0)
+        if day_edge < hour_edge:
+            day_edge += timedelta(days=1)
+        return {
+            f"{prefix}_since": since.isoformat(" "),
+            f"{prefix}_since_ts": int(since.timestamp()),
+            f"{prefix}_hour_edge": hour_edge.isoformat(" "),
+            f"{prefix}_hour_edge_ts": int(hour_edge.timestamp()),
+            f"{prefix}_day_edge_hour": day_edge.isoformat(" "),
+            f"{prefix}_day_edge": day_edge.strftime("%Y-%m-%d")
+        }
+    
+    def _window_params(self, days: int) -> Dict[str, Any]:
+        """Sorgu pencereleri: rapor dönemi (aylık) ve son 24 saat (günlük)"""
+        now = datetime.now()
+        return {
+            **self._window_edges("monthly", now - timedelta(days=days)),
+            **self._window_edges("daily", now - timedelta(days=1))
+        }
+    
+    def _window_rows_sql(self, prefix: str, user_filter: str = "", legacy: bool = False) -> str:
+        """Pencere içindeki (user_id, model) kısmi toplamları: ham satır + saatlik + günlük rollup birleşimi.
+        Ham satırlara sadece pencerenin başındaki yarım saat için gidilir; geçmiş büyüdükçe maliyet artmaz.
+        Ham kısım covering index'ten okunur (idx_logs_ts / idx_logs_user_ts), model adı gruplamadan sonra eklenir."""
+        legacy_rows = f'''
+            UNION ALL
+            SELECT 
+                user_id,
+                model,
+                COUNT(*),
+                SUM(tokens_used),
+                SUM(cost_usd),
+                SUM(response_time),
+                SUM(CASE WHEN success THEN 1 ELSE 0 END),
+                MAX(timestamp)
+            FROM usage_logs_legacy 
+            WHERE timestamp >= :{prefix}_since AND timestamp < :{prefix}_hour_edge
+                AND parent_request_id IS NULL AND id < (SELECT watermark FROM usage_backfill) {user_filter}
+            GROUP BY user_id, model
+        ''' if legacy else ""
+        return f'''
+            SELECT 
+                raw.user_id,
+                models.name AS model,
+                raw.requests,
+                raw.tokens,
+                raw.cost_usd,
+                raw.response_time_sum,
+                raw.successes,
+                datetime(raw.last_ts, 'unixepoch', 'localtime') AS last_activity
+            FROM (
+                SELECT 
+                    user_id,
+                    model_id,
+                    COUNT(*) AS requests,
+                    SUM(tokens_used) AS tokens,
+                    SUM(cost_usd) AS cost_usd,
+                    SUM(response_time) AS response_time_sum,
+                    SUM(success) AS successes,
+                    MAX(ts) AS last_ts
+                FROM usage_logs 
+                WHERE ts >= :{prefix}_since_ts AND ts < :{prefix}_hour_edge_ts
+                    AND parent_request_id IS NULL {user_filter}
+                GROUP BY user_id, model_id
+            ) AS raw
+            JOIN models ON models.id = raw.model_id
+            {legacy_rows}
+            UNION ALL
+            SELECT user_id, model, requests, tokens, cost_usd, response_time_sum, successes, last_activity
+            FROM usage_hourly 
+            WHERE hour >= :{prefix}_hour_edge AND hour < :{prefix}_day_edge_hour {user_filter}
+            UNION ALL
+            SELECT user_id, model, requests, tokens, cost_usd, response_time_sum, successes, last_activity
+            FROM usage_daily 
+            WHERE day >= :{prefix}_day_edge {user_filter}
+        '''
+    
+    def _user_totals_sql(self, user_filter: str = "", legacy: bool = False) -> str:
+        """Kullanıcı bazında dönem toplamları + son 24 saat (UserStats kolon sırasıyla)"""
+        return f'''
+            SELECT 
+                monthly.user_id,
+                monthly.total_requests,
+                monthly.total_tokens,
+                monthly.total_cost,
+                monthly.response_time_sum / monthly.total_requests AS avg_response_time,
+                monthly.successes * 1.0 / monthly.total_requests AS success_rate,
+                monthly.last_activity,
+                COALESCE(daily.requests, 0) AS daily_requests,
+                COALESCE(daily.tokens, 0) AS daily_tokens
+            FROM (
+                SELECT 
+                    user_id,
+                    SUM(requests) AS total_requests,
+                    SUM(tokens) AS total_tokens,
+                    SUM(cost_usd) AS total_cost,
+                    SUM(response_time_sum) AS response_time_sum,
+                    SUM(successes) AS successes,
+                    MAX(last_activity) AS last_activity
+                FROM ({self._window_rows_sql("monthly", user_filter, legacy)})
+                GROUP BY user_id
+            ) AS monthly
+            LEFT JOIN (
+                SELECT user_id, SUM(requests) AS requests, SUM(tokens) AS tokens
+                FROM ({self._window_rows_sql("daily", user_filter, legacy)})
+                GROUP BY user_id
+            ) AS daily USING (user_id)
+        '''
+    
+    def _row_to_user_stats(self, row: tuple) -> UserStats:
+        """_user_totals_sql satırından UserStats"""
         return UserStats(
-            user_id=user_id,
-            total_requests=result[0] or 0,
-            total_tokens=result[1] or 0,
-            total_cost=result[2] or 0.0,
-            avg_response_time=result[3] or 0.0,
-            success_rate=(result[4] or 0.0) * 100,
-            last_activity=datetime.fromisoformat(result[5]) if result[5] else now,
-            daily_requests=daily_result[0] or 0,
-            daily_tokens=daily_result[1] or 0,
-            monthly_requests=monthly_result[0] or 0,
-            monthly_tokens=monthly_result[1] or 0
+            user_id=row[0],
+            total_requests=row[1] or 0,
+            total_tokens=row[2] or 0,
+            total_cost=row[3] or 0.0,
+            avg_response_time=row[4] or 0.0,
+            success_rate=(row[5] or 0.0) * 100,
+            last_activity=datetime.fromisoformat(row[6]) if row[6] else datetime.now(),
+            daily_requests=row[7] or 0,
+            daily_tokens=row[8] or 0,
+            monthly_requests=row[1] or 0,
+            monthly_tokens=row[2] or 0
         )
     
-    def get_all_users_stats(self, days: int = 30) -> List[UserStats]:
-        """Tüm kullanıcıların istatistiklerini getir"""
+    def get_user_stats(self, user_id: str, days: int = 30) -> Optional[UserStats]:
+        """Kullanıcı istatistiklerini getir (rollup'lardan; geçmişin uzunluğundan bağımsız)"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # Aktif kullanıcıları bul
-        cursor.execute('''
-            SELECT DISTINCT user_id 
-            FROM usage_logs 
-            WHERE timestamp >= ?
-        ''', (datetime.now() - timedelta(days=days),))
+        legacy = self._begin_read(cursor)
         
-        user_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        cursor.execute(
+            self._user_totals_sql("AND user_id = :user_id", legacy),
+            {"user_id": user_id, **self._window_params(days)}
+        )
         
-        stats = []
-        for user_id in user_ids:
-            user_stats = self.get_user_stats(user_id, days)
-            if user_stats:
-                stats.append(user_stats)
+        result = cursor.fetchone()
+        conn.close()
         
-        return sorted(stats, key=lambda x: x.total_cost, reverse=True)
+        if not result:
+            return None
+        return self._row_to_user_stats(result)
     
-    def generate_report(self, days: int = 30) -> Dict[str, Any]:
-        """Detaylı rapor oluştur"""
-        all_stats = self.get_all_users_stats(days)
-        
-        if not all_stats:
-            return {"error": "Veri bulunamadı"}
+    def get_all_users_stats(self, days: int = 30) -> List[UserStats]:
+        """Tüm kullanıcıların istatistiklerini getir (tek sorgu, maliyete göre sıralı)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
         
-        # Toplam istatistikler
-        total_users = len(all_stats)
-        total_requests = sum(s.total_requests for s in all_stats)
-        total_tokens = sum(s.total_tokens for s in all_stats)
-        total_cost = sum(s.total_cost for s in all_stats)
-        avg_response_time = sum(s.avg_response_time for s in all_stats) / total_users
-        avg_success_rate = sum(s.success_rate for s in all_stats) / total_users
+        legacy = self._begin_read(cursor)
         
-        # En aktif kullanıcılar
-        top_users_by_requests = sorted(all_stats, key=lambda x: x.total_requests, reverse=True)[:10]
-        top_users_by_cost = sorted(all_stats, key=lambda x: x.total_cost, reverse=True)[:10]
+        cursor.execute(
+            self._user_totals_sql(legacy=legacy) + "ORDER BY total_cost DESC",
+            self._window_params(days)
+        )
         
-        # Model kullanım istatistikleri
+        stats = [self._row_to_user_stats(row) for row in cursor.fetchall()]
+        conn.close()
+        return stats
+    
+    def generate_report(self, days: int = 30, top_n: int = 10) -> Dict[str, Any]:
+        """Detaylı rapor oluştur.
+        Kullanıcı toplamları rollup'lardan bir kez hesaplanır (geçici tablo); özet ve top-N bu tablodan,
+        model kırılımı ikinci bir gruplanmış sorgudan gelir. Hepsi tek bağlantıda."""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
+        params = self._window_params(days)
+        legacy = self._begin_read(cursor)
+        
+        cursor.execute("CREATE TEMP TABLE report_user_totals AS " + self._user_totals_sql(legacy=legacy), params)
         
+        # Toplam istatistikler (ortalamalar kullanıcı ortalamalarının ortalaması)
         cursor.execute('''
+            SELECT 
+                COUNT(*),
+                SUM(total_requests),
+                SUM(total_tokens),
+                SUM(total_cost),
+                AVG(avg_response_time),
+                AVG(success_rate) * 100
+            FROM report_user_totals
+        ''')
+        total_users, total_requests, total_tokens, total_cost, avg_response_time, avg_success_rate = cursor.fetchone()
+        
+        if not total_users:
+            conn.close()
+            return {"error": "Veri bulunamadı"}
+        
+        # En aktif kullanıcılar
+        cursor.execute('''
+            SELECT user_id, total_requests, total_tokens, total_cost
+            FROM report_user_totals
+            ORDER BY total_requests DESC
+            LIMIT ?
+        ''', (top_n,))
+        top_users_by_requests = cursor.fetchall()
+        
+        cursor.execute('''
+            SELECT user_id, total_requests, total_tokens, total_cost
+            FROM report_user_totals
+            ORDER BY total_cost DESC
+            LIMIT ?
+        ''', (top_n,))
+        top_users_by_cost = cursor.fetchall()
+        
+        # Model kullanım istatistikleri
+        cursor.execute(f'''
             SELECT 
                 model,
-                COUNT(*) as request_count,
-                SUM(tokens_used) as total_tokens,
+                SUM(requests) as request_count,
+                SUM(tokens) as total_tokens,
                 SUM(cost_usd) as total_cost
-            FROM usage_logs 
-            WHERE timestamp >= ?
+            FROM ({self._window_rows_sql("monthly", legacy=legacy)})
             GROUP BY model
             ORDER BY total_cost DESC
-        ''', (datetime.now() - timedelta(days=days),))
+        ''', params)
         
         model_stats = cursor.fetchall()
         conn.close()
@@ -261,19 +927,19 @@ class UsageMonitor:
             },
             "top_users_by_requests": [
                 {
-                    "user_id": s.user_id,
-                    "requests": s.total_requests,
-                    "tokens": s.total_tokens,
-                    "cost": round(s.total_cost, 2)
-                } for s in top_users_by_requests
+                    "user_id": row[0],
+                    "requests": row[1],
+                    "tokens": row[2],
+                    "cost": round(row[3], 2)
+                } for row in top_users_by_requests
             ],
             "top_users_by_cost": [
                 {
-                    "user_id": s.user_id,
-                    "cost": round(s.total_cost, 2),
-                    "requests": s.total_requests,
-                    "tokens": s.total_tokens
-                } for s in top_users_by_cost
+                    "user_id": row[0],
+                    "cost": round(row[3], 2),
+                    "requests": row[1],
+                    "tokens": row[2]
+                } for row in top_users_by_cost
             ],
             "model_usage": [
                 {
@@ -327,7 +993,7 @@ class UsageMonitor:
 
 def simulate_usage_data():
     """Test için örnek kullanım verisi oluştur"""
-    monitor = UsageMonitor()
+    monitor = UsageMonitor(overflow_policy="block", enqueue_timeout=5.0)
     
     # 10 test kullanıcısı için 30 günlük veri
     users = [f"user_{i:03d}" for i in range(1, 11)]
@@ -363,6 +1029,8 @@ def simulate_usage_data():
                 
                 monitor.log_usage(record)
     
+    # Rapor okumadan önce kuyruktaki kayıtlar yazılsın
+    monitor.flush()
     print("✅ Test verisi oluşturuldu!")
     return monitor
 